@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
 
 from .forms import AuthorChangeForm, AuthorCreationForm
 from .models import Author, Comment, Post
@@ -7,14 +8,27 @@ from .models import Author, Comment, Post
 
 @admin.action(description='Одобрить комментарии')
 def make_active(modeladmin, request, queryset):
-    queryset.update(active=True)
+    approved = queryset.approve()
+    modeladmin.message_user(request, f'Одобрено комментариев: {approved}')
+
+
+class DeleteEachMixin:
+    """
+    Bulk delete through each object's delete(): QuerySet.delete() would skip
+    the counters, the search index and the cache versions it maintains.
+    """
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for obj in queryset:
+                obj.delete()
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(DeleteEachMixin, admin.ModelAdmin):
     list_display = ['title', 'slug', 'author', 'publish', 'status']
     list_filter = ['status', 'created', 'publish', 'author']
-    search_fields = ['title', 'body', 'username']
+    search_fields = ['title', 'body', 'author__username']
     prepopulated_fields = {'slug': ('title',)}
     raw_id_fields = ['author']
     date_hierarchy = 'publish'
@@ -22,7 +36,7 @@ class PostAdmin(admin.ModelAdmin):
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(DeleteEachMixin, admin.ModelAdmin):
     list_display = ['name', 'email', 'post', 'created', 'active']
     list_filter = ['active', 'created', 'updated']
     search_fields = ['name', 'email', 'body']
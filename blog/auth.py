@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+# What request.user is needed for on every request: the session hash check
+# (password), permission checks and the names shown in the navigation, the
+# admin header and the comment form. Profile columns load on access.
+REQUEST_USER_FIELDS = ('id', 'password', 'username', 'email', 'first_name', 'last_name',
+                       'is_active', 'is_staff', 'is_superuser')
+
+
+class SlimModelBackend(ModelBackend):
+    """ModelBackend loading request.user without the profile photo, description and counters."""
+
+    def get_user(self, user_id):
+        user_model = get_user_model()
+        try:
+            user = user_model._default_manager.only(*REQUEST_USER_FIELDS).get(pk=user_id)
+        except user_model.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from ...pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """PostgreSQL with a bounded, health-checked connection pool per process."""
@@ -0,0 +1,14 @@
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.sqlite3 import base
+
+from ...pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """SQLite with the connection pool, for development and the pool load test."""
+
+    def close(self):
+        # SQLite never closes in-memory database connections, which would keep
+        # them checked out forever; the pool holds them open instead.
+        self.validate_thread_sharing()
+        BaseDatabaseWrapper.close(self)
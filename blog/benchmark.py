@@ -0,0 +1,402 @@
+import asyncio
+import io
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import urls as blog_urls
+from .bulk import batched
+from .counters import reconcile_counters
+from .models import Author, Comment, Post
+from .pool import get_pool
+from .rendering import MARKDOWN_RENDERER_VERSION, render_markdown
+from .search import rebuild_index
+from .sitemaps import SITEMAP_DIR, generate_sitemaps
+
+BUDGET_FILE = Path(__file__).with_name('benchmark_budget.json')
+
+
+def generate_authors(count):
+    password = make_password('benchmark')
+    for i in range(count):
+        yield Author(username=f'bench-author-{i}', email=f'bench-author-{i}@example.com', password=password,
+                     description='Автор для нагрузочного теста')
+
+
+def generate_posts(count, author_ids, rng):
+    now = timezone.now()
+    short_html = render_markdown('Краткое *описание* поста')
+    body = 'Текст **поста** с `кодом`.\n\n' * 20
+    body_html = render_markdown(body)
+    for i in range(count):
+        published = i % 10 != 0
+        moment = now - timedelta(minutes=count - i)
+        yield Post(title=f'Пост {i}', slug=f'bench-post-{i}', author_id=rng.choice(author_ids),
+                   short_description='Краткое *описание* поста', body=body,
+                   short_description_html=short_html, body_html=body_html,
+                   rendered_version=MARKDOWN_RENDERER_VERSION,
+                   status='published' if published else 'draft',
+                   publish=moment, first_published=moment if published else None)
+
+
+def generate_comments(count, post_ids, rng):
+    body_html = render_markdown('Отличный *пост*!')
+    for i in range(count):
+        yield Comment(post_id=rng.choice(post_ids), name=f'Читатель {i}', email=f'reader-{i}@example.com',
+                      body='Отличный *пост*!', body_html=body_html, rendered_version=MARKDOWN_RENDERER_VERSION,
+                      active=i % 5 != 0)
+
+
+def seed(authors=10_000, posts=100_000, comments=1_000_000, batch_size=5_000, seed_value=0):
+    """
+    Fill the database with generated rows through bulk_create, bypassing
+    model save() side effects. Rows are streamed in batches, so memory does
+    not grow with the dataset size.
+    """
+    rng = random.Random(seed_value)
+    for batch in batched(generate_authors(authors), batch_size):
+        Author.objects.bulk_create(batch)
+    author_ids = list(Author.objects.filter(username__startswith='bench-author-').values_list('id', flat=True))
+    for batch in batched(generate_posts(posts, author_ids, rng), batch_size):
+        Post.objects.bulk_create(batch)
+    post_ids = list(Post.objects.filter(slug__startswith='bench-post-').values_list('id', flat=True))
+    for batch in batched(generate_comments(comments, post_ids, rng), batch_size):
+        Comment.objects.bulk_create(batch)
+    rebuild_index()
+    reconcile_counters(Author, Post, Comment, batch_size)
+
+
+# Routes of the project urls.py served by blog views, besides blog/urls.py.
+PROJECT_ROUTES = ('sitemap', 'sitemap_file')
+
+
+def routes():
+    """
+    (name, method, url, data, login) for every URL name of blog/urls.py and
+    PROJECT_ROUTES, plus signed-in variants of some. A URL added to
+    blog/urls.py without the arguments it needs below fails to reverse.
+    """
+    post = Post.published.order_by('-publish', '-id').first()
+    author = post.author
+    staff, _ = Author.objects.get_or_create(username='bench-staff', defaults={
+        'email': 'bench-staff@example.com', 'is_staff': True, 'password': make_password(None)})
+    # Sitemap files only exist once the periodic task has written them.
+    generate_sitemaps()
+    chunk = min(name for name in default_storage.listdir(SITEMAP_DIR)[1] if name.endswith('.xml.gz'))
+    own = {'login': author}
+    kwargs = {
+        'feed': {'feed_format': 'rss'},
+        'post_detail': {'slug': post.slug},
+        'post_update': {'pk': post.pk},
+        'post_delete': {'pk': post.pk},
+        'post_by_auth': {'pk': author.pk},
+        'post_comment': {'post_id': post.pk},
+        'author_profile': {'pk': author.pk},
+        'author_feed': {'pk': author.pk, 'feed_format': 'atom'},
+        'sitemap_file': {'name': chunk},
+    }
+    requests = {
+        'search': ('get', {'q': 'пост'}, {}),
+        'post_create': ('get', None, own),
+        'post_update': ('get', None, own),
+        'post_delete': ('get', None, own),
+        'post_comment': ('post', {'name': 'Читатель', 'email': 'reader@example.com', 'body': 'Комментарий'}, {}),
+        'performance_stats': ('get', None, {'login': staff}),
+        'db_pool_stats': ('get', None, {'login': staff}),
+    }
+    names = [pattern.name for pattern in blog_urls.urlpatterns]
+    result = []
+    for name in names + list(PROJECT_ROUTES):
+        url = reverse(f'blog:{name}' if name in names else name, kwargs=kwargs.get(name))
+        method, data, options = requests.get(name, ('get', None, {}))
+        result.append((name, method, url, data, options))
+    return result + [
+        ('posts_authenticated', 'get', reverse('blog:posts'), None, own),
+        ('post_detail_authenticated', 'get', post.get_absolute_url(), None, own),
+        ('post_by_auth_own', 'get', reverse('blog:post_by_auth', args=[author.pk]), None, own),
+        ('visitor_authenticated', 'get', reverse('blog:visitor'), None, own),
+    ]
+
+
+def run(requests=20, warm_cache=False):
+    """Request every route and return {name: {queries, p50_ms, p95_ms, bytes}}."""
+    results = {}
+    for name, method, url, data, options in routes():
+        client = Client()
+        if options.get('login'):
+            client.force_login(options['login'])
+        timings, queries, size = [], 0, 0
+        for _ in range(requests):
+            if not warm_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                # Streamed responses (feeds) run their queries while the body is read.
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise AssertionError(f'{name}: {url} returned {response.status_code}')
+            queries = max(queries, len(ctx.captured_queries))
+            size = len(body)
+        timings.sort()
+        results[name] = {
+            'queries': queries,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+            'bytes': size,
+        }
+    return results
+
+
+# Public read views served by both handlers in run_concurrent().
+READ_ROUTES = ('posts', 'contact', 'post_detail', 'post_by_auth', 'author_profile')
+
+
+@contextmanager
+def query_latency(seconds):
+    """Sleep before every query on connections opened inside the block, like a database across the network."""
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+    if seconds:
+        connection_created.connect(install)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+
+
+def _wsgi_get(handler, url, headers=None):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+        **(headers or {}),
+    }
+    status = []
+    body = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    return int(status[0].split()[0])
+
+
+async def _asgi_get(handler, url):
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler({
+        'type': 'http', 'method': 'GET', 'path': url, 'raw_path': url.encode(), 'query_string': b'',
+        'root_path': '', 'scheme': 'http', 'server': ('testserver', 80), 'headers': [(b'host', b'testserver')],
+    }, receive, send)
+    return status[0]
+
+
+def _wsgi_throughput(url, requests, workers):
+    handler = WSGIHandler()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        statuses = list(pool.map(lambda _: _wsgi_get(handler, url), range(requests)))
+    return time.perf_counter() - start, statuses
+
+
+def _asgi_throughput(url, requests, concurrency):
+    async def drive():
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with semaphore:
+                return await _asgi_get(handler, url)
+
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(get() for _ in range(requests)))
+        return time.perf_counter() - start, statuses
+
+    return asyncio.run(drive())
+
+
+def run_concurrent(requests=200, concurrency=20, wsgi_workers=1, latency=0.0, warm_cache=False):
+    """
+    Requests per second of the READ_ROUTES as anonymous GETs through the
+    WSGI handler on `wsgi_workers` threads (1 is a sync gunicorn worker)
+    and through the ASGI handler with `concurrency` requests in flight, as
+    under a uvicorn worker. `latency` seconds are added to every query.
+    Returns {name: {wsgi_rps, asgi_rps}}.
+    """
+    urls = {name: url for name, method, url, data, options in routes()}
+    no_cache = {} if warm_cache else {'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}}
+    results = {}
+    with override_settings(**no_cache), query_latency(latency):
+        for name in READ_ROUTES:
+            url = urls[name]
+            wsgi_time, wsgi_statuses = _wsgi_throughput(url, requests, wsgi_workers)
+            asgi_time, asgi_statuses = _asgi_throughput(url, requests, concurrency)
+            if any(status >= 400 for status in wsgi_statuses + asgi_statuses):
+                raise AssertionError(f'{name}: {url} returned an error')
+            results[name] = {'wsgi_rps': round(requests / wsgi_time, 1), 'asgi_rps': round(requests / asgi_time, 1)}
+    return results
+
+
+SESSION_CONFIGURATIONS = {
+    'db_sessions': {'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+                    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend']},
+    'cached_sessions': {'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+                        'AUTHENTICATION_BACKENDS': ['blog.auth.SlimModelBackend']},
+}
+
+
+def run_session_throughput(requests=200):
+    """
+    Requests per second of the feed through the WSGI handler for anonymous
+    and logged-in visitors, with database sessions and the full user row
+    and with cached sessions and the slim request.user (the settings).
+    Returns {traffic: {configuration: rps}}.
+    """
+    url = reverse('blog:posts')
+    author = Author.objects.order_by('pk').first()
+    results = {}
+    for name, configuration in SESSION_CONFIGURATIONS.items():
+        with override_settings(**configuration):
+            client = Client()
+            client.force_login(author)
+            session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].output(header='', attrs=[]).strip()
+            handler = WSGIHandler()
+            for traffic, headers in (('anonymous', {}), ('logged_in', {'HTTP_COOKIE': session_cookie})):
+                cache.clear()
+                # Warm up: the anonymous page cache and the cached session.
+                _wsgi_get(handler, url, headers)
+                start = time.perf_counter()
+                statuses = [_wsgi_get(handler, url, headers) for _ in range(requests)]
+                elapsed = time.perf_counter() - start
+                if any(status != 200 for status in statuses):
+                    raise AssertionError(f'{traffic}: {url} returned an error')
+                results.setdefault(traffic, {})[name] = round(requests / elapsed, 1)
+    return results
+
+
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'blog.backends.postgresql',
+    'django.db.backends.sqlite3': 'blog.backends.sqlite3',
+}
+
+
+@contextmanager
+def _database_alias(alias, **overrides):
+    """A temporary alias for the current 'default' database."""
+    connections.settings[alias] = {**connection.settings_dict, **overrides}
+    try:
+        yield alias
+    finally:
+        connections.close_all()
+        del connections.settings[alias]
+
+
+def _serve(alias, requests, latency):
+    """Simulated requests on one worker thread: Django's request signals around a query and `latency` of work."""
+    durations = []
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            request_started.send(sender=None)
+            list(Post.published.using(alias).order_by('-publish', '-id').values_list('id', flat=True)[:5])
+            time.sleep(latency)
+            request_finished.send(sender=None)
+            durations.append(time.perf_counter() - start)
+    finally:
+        connections[alias].close()
+    return durations
+
+
+def _opened_connections(alias, workers, requests, latency):
+    opened = []
+
+    def count(sender, connection, **kwargs):
+        if connection.alias == alias:
+            opened.append(connection)
+
+    connection_created.connect(count)
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            durations = sum(executor.map(lambda _: _serve(alias, requests, latency), range(workers)), [])
+    finally:
+        connection_created.disconnect(count)
+    return len(opened), durations
+
+
+def run_pool_load(worker_counts=(1, 4, 16, 64), requests=20, pool_size=5, latency=0.005):
+    """
+    Database connections held by `workers` threads each serving `requests`
+    simulated requests, with persistent connections (CONN_MAX_AGE=600,
+    one per thread) and with the pooled backend (POOL SIZE=pool_size,
+    CONN_MAX_AGE=0). Returns {workers: {persistent, pooled, avg_wait_ms,
+    persistent_p95_ms, pooled_p95_ms}}.
+    """
+    engine = POOLED_ENGINES[connection.settings_dict['ENGINE']]
+    results = {}
+    for workers in worker_counts:
+        with _database_alias('benchmark_persistent', CONN_MAX_AGE=600) as alias:
+            persistent, persistent_durations = _opened_connections(alias, workers, requests, latency)
+        with _database_alias(f'benchmark_pooled_{workers}', ENGINE=engine, CONN_MAX_AGE=0,
+                             POOL={'SIZE': pool_size}) as alias:
+            _, pooled_durations = _opened_connections(alias, workers, requests, latency)
+            pool = get_pool(alias, {})
+            stats = pool.snapshot()
+            pool.close_idle()
+        results[workers] = {
+            'persistent': persistent,
+            'pooled': stats['max_open'],
+            'avg_wait_ms': stats['avg_wait_ms'],
+            'persistent_p95_ms': _p95_ms(persistent_durations),
+            'pooled_p95_ms': _p95_ms(pooled_durations),
+        }
+    return results
+
+
+def _p95_ms(durations):
+    timings = sorted(durations)
+    return round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 2)
+
+
+def load_budget(path=BUDGET_FILE):
+    with open(path) as budget_file:
+        return json.load(budget_file)
+
+
+def over_budget(results, budget):
+    """Return messages for routes whose query count exceeds the stored budget."""
+    return [f'{name}: {result["queries"]} queries, budget {budget[name]}'
+            for name, result in results.items() if name in budget and result['queries'] > budget[name]]
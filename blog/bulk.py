@@ -0,0 +1,221 @@
+"""
+Streaming JSONL/CSV export and import of authors, posts and comments.
+
+Rows reference each other by natural keys, so a dump can be loaded into a
+database with other primary keys: posts name their author by username,
+comments their post by title (unique, and unlike the slug not recomputed on
+import). Files are read and written one batch at a time, so memory does not
+grow with their size.
+
+Imports insert with bulk_create: Post.save/Comment.save and the model
+signals do not run and no notification is queued. What save() would have
+done is done per batch instead: slugs, rendered Markdown, counters, the
+SQLite search index and cache versions. created/updated are set to the
+time of the import; rows keep their relative order, as dumps are written
+in primary-key order.
+"""
+import csv
+import itertools
+import json
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+
+from pytils import translit
+
+from .cache import bump_versions
+from .models import Author, Comment, Post, add_approved_comments, add_published_posts
+from .routers import use_primary
+from .search import index_posts
+from .sitemaps import keyset_rows
+from .slugs import unique_slugs
+
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 1000
+
+# Exported columns, in order.
+FIELDS = {
+    'authors': ('username', 'email', 'password', 'first_name', 'last_name', 'description',
+                'is_active', 'is_staff', 'is_superuser', 'date_joined'),
+    'posts': ('title', 'author', 'short_description', 'body', 'status', 'publish', 'first_published'),
+    'comments': ('post', 'name', 'email', 'body', 'active'),
+}
+# Columns holding natural keys of other models, as the lookups that export them.
+REFERENCES = {
+    'posts': {'author': 'author__username'},
+    'comments': {'post': 'post__title'},
+}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def format_of(path, file_format=None):
+    """`file_format`, or the one of the extension of `path`; JSONL for standard input or output (-)."""
+    file_format = file_format or ('jsonl' if path == '-' else path.rpartition('.')[2])
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown format {file_format!r}, expected one of {", ".join(FORMATS)}')
+    return file_format
+
+
+def _exported(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def export_rows(kind, batch_size=BATCH_SIZE):
+    """Yield {column: value} dicts of every `kind` row in primary-key order, one keyset query per batch."""
+    model = {'authors': Author, 'posts': Post, 'comments': Comment}[kind]
+    references = REFERENCES.get(kind, {})
+    fields = FIELDS[kind]
+    lookups = [references.get(field, field) for field in fields]
+    stop = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    for row in keyset_rows(model.objects.all(), ('pk', *lookups), 0, stop, batch_size):
+        yield dict(zip(fields, map(_exported, row[1:])))
+
+
+def write_rows(rows, stream, file_format, fields):
+    """Write `rows` to the text `stream`; return how many were written."""
+    written = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fields)
+        writer.writeheader()
+        for written, row in enumerate(rows, 1):
+            writer.writerow(row)
+    else:
+        for written, row in enumerate(rows, 1):
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return written
+
+
+def read_rows(stream, file_format):
+    """Yield {column: value} dicts from the text `stream`, one line at a time."""
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _values(model, row, fields):
+    """
+    Model field values of `row`: JSON and CSV strings alike go through
+    Field.to_python(). Missing and empty columns (CSV has no null) take the
+    field's default.
+    """
+    values = {}
+    for name in fields:
+        if row.get(name) not in (None, ''):
+            values[name] = model._meta.get_field(name).to_python(row[name])
+    return values
+
+
+def _by_key(rows, key, existing):
+    """Rows of the batch with a new, not repeated, non-empty `key` column."""
+    fresh = {}
+    for row in rows:
+        value = row.get(key)
+        if value and value not in existing and value not in fresh:
+            fresh[value] = row
+    return fresh
+
+
+def import_authors(rows):
+    fields = FIELDS['authors']
+    usernames = {row.get('username') for row in rows}
+    emails = {row.get('email') for row in rows}
+    existing = set(Author.objects.filter(username__in=usernames).values_list('username', flat=True))
+    taken_emails = set(Author.objects.filter(email__in=emails).values_list('email', flat=True))
+    authors = []
+    for row in _by_key(rows, 'username', existing).values():
+        if row.get('email') in taken_emails:
+            continue
+        taken_emails.add(row.get('email'))
+        author = Author(**_values(Author, row, fields))
+        if not author.password:
+            author.password = make_password(None)
+        authors.append(author)
+    Author.objects.bulk_create(authors)
+    return authors
+
+
+def import_posts(rows):
+    fields = [field for field in FIELDS['posts'] if field not in REFERENCES['posts']]
+    author_ids = dict(Author.objects.filter(username__in={row.get('author') for row in rows})
+                      .values_list('username', 'id'))
+    existing = set(Post.objects.filter(title__in={row.get('title') for row in rows})
+                   .values_list('title', flat=True))
+    posts = []
+    for row in _by_key(rows, 'title', existing).values():
+        if row.get('author') not in author_ids:
+            continue
+        post = Post(author_id=author_ids[row['author']], **_values(Post, row, fields))
+        if post.status == 'published' and post.first_published is None:
+            # Set, so a later save() does not announce the imported post as new.
+            post.first_published = post.publish
+        post.render_markdown()
+        posts.append(post)
+    slugs = unique_slugs(Post.objects.all(), [translit.translify(post.title) for post in posts],
+                         Post._meta.get_field('slug').max_length)
+    for post, slug in zip(posts, slugs):
+        post.slug = slug
+    if not posts:
+        return posts
+    Post.objects.bulk_create(posts)
+    published = Counter(post.author_id for post in posts if post.status == 'published')
+    if published:
+        add_published_posts(published)
+    index_posts(posts)
+    bump_versions('feed', *(f'author:{post.author_id}' for post in posts))
+    return posts
+
+
+def import_comments(rows):
+    fields = [field for field in FIELDS['comments'] if field not in REFERENCES['comments']]
+    posts = {title: (pk, slug) for title, pk, slug in Post.objects.filter(title__in={row.get('post') for row in rows})
+             .values_list('title', 'id', 'slug')}
+    comments = []
+    for row in rows:
+        if row.get('post') not in posts:
+            continue
+        comment = Comment(post_id=posts[row['post']][0], **_values(Comment, row, fields))
+        comment.render_markdown()
+        comments.append(comment)
+    Comment.objects.bulk_create(comments)
+    approved = Counter(comment.post_id for comment in comments if comment.active)
+    if approved:
+        add_approved_comments(approved)
+        slugs = {pk: slug for pk, slug in posts.values()}
+        bump_versions(*(f'post:{post_id}' for post_id in approved), *(f'slug:{slugs[post_id]}' for post_id in approved))
+    return comments
+
+
+IMPORTERS = {'authors': import_authors, 'posts': import_posts, 'comments': import_comments}
+
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE, progress=None):
+    """
+    Insert `rows` of `kind` one transaction per batch and return
+    (imported, skipped). Rows whose natural key exists already (authors,
+    posts) or whose reference is unknown are skipped, so an interrupted
+    import of authors or posts can simply be run again; comments have no
+    natural key and are imported again. `progress(imported, skipped)` is
+    called after every batch.
+    """
+    imported = skipped = 0
+    for batch in batched(rows, batch_size):
+        # Existing keys and slugs are checked on the primary: a lagging replica
+        # would let duplicates through to the unique constraints.
+        with use_primary(), transaction.atomic():
+            created = len(IMPORTERS[kind](batch))
+        imported += created
+        skipped += len(batch) - created
+        if progress:
+            progress(imported, skipped)
+    return imported, skipped
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import time
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date, parse_http_date_safe, urlencode
+
+from .edge import purge_on_commit
+from .middleware import count_cache_lookups
+from .routers import PIN_COOKIE
+
+
+# Scopes are short strings naming what a cached page or fragment depends on:
+# 'feed' (the published feed), 'post:<id>', 'author:<id>' and 'slug:<slug>'
+# (the post detail page, whose URL only has the slug).
+
+def _version_key(scope):
+    # Slugs may be long or hold spaces: keep the keys short and memcached-safe.
+    return f'blog:version:{hashlib.md5(scope.encode()).hexdigest()}'
+
+
+def _new_version():
+    # Restarting from a fresh timestamp after eviction never reuses an old version.
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    count_cache_lookups(len(versions), len(keys) - len(versions))
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+async def aget_versions(*scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = await cache.aget_many(keys)
+    count_cache_lookups(len(versions), len(keys) - len(versions))
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, None)
+        versions.update(missing)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def bump_versions(*scopes):
+    """Invalidate the cached pages and fragments of `scopes`, here and, once committed, on the edge."""
+    scopes = set(scopes)
+    _bump(scopes)
+    # Until the commit other requests still read the old rows, and may cache
+    # what they render under the version just bumped: bump again once committed.
+    transaction.on_commit(lambda: _bump(scopes))
+    # Slug scopes only key the page cache: the edge knows the detail page by 'post:<id>'.
+    purge_on_commit(*(scope for scope in scopes if not scope.startswith('slug:')))
+
+
+def has_session(request):
+    """False when request.user is anonymous without reading any session or user data."""
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def _is_cacheable(request):
+    # Visitors pinned to the primary after a write get a fresh render, not a page a replica may have built.
+    # Only touches request.user with a session cookie: reading it marks the session
+    # accessed, which adds Vary: Cookie and keeps the page off the edge cache.
+    return (request.method == 'GET' and 'messages' not in request.COOKIES and PIN_COOKIE not in request.COOKIES
+            and not (has_session(request) and request.user.is_authenticated))
+
+
+def _page_key(request, params, version):
+    # Other query parameters don't change the page: they must not create cache entries.
+    query = urlencode([(name, request.GET.getlist(name)) for name in params if name in request.GET], doseq=True)
+    path = hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+    return f'blog:page:{path}:{version}'
+
+
+def _should_store(response):
+    return response.status_code == 200 and not response.cookies
+
+
+def cache_anonymous_page(*scopes, params=()):
+    """
+    Cache the whole response of a GET view for anonymous visitors.
+
+    `scopes` may contain URL kwargs placeholders, e.g. 'author:{pk}'.
+    `params` names the query parameters the view reads; the others are
+    left out of the cache key. Only use it on pages without CSRF tokens or
+    other per-visitor content. Works on both sync and async views.
+    """
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_async_view(request, *args, **kwargs):
+                # Without a session cookie nothing is loaded: no need to leave the event loop.
+                if has_session(request):
+                    cacheable = await sync_to_async(_is_cacheable)(request)
+                else:
+                    cacheable = _is_cacheable(request)
+                if not cacheable:
+                    return await view_func(request, *args, **kwargs)
+
+                key = _page_key(request, params, await aget_versions(*(scope.format(**kwargs) for scope in scopes)))
+                response = await cache.aget(key)
+                count_cache_lookups(response is not None, response is None)
+                if response is not None:
+                    return _answer_from_cache(request, response)
+
+                response = await view_func(request, *args, **kwargs)
+                if _should_store(response):
+                    await cache.aset(key, response, settings.BLOG_PAGE_CACHE_TIMEOUT)
+                return response
+            return _wrapped_async_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                return view_func(request, *args, **kwargs)
+
+            key = _page_key(request, params, get_versions(*(scope.format(**kwargs) for scope in scopes)))
+            response = cache.get(key)
+            count_cache_lookups(response is not None, response is None)
+            if response is not None:
+                return _answer_from_cache(request, response)
+
+            response = view_func(request, *args, **kwargs)
+            if _should_store(response):
+                if hasattr(response, 'render') and callable(response.render):
+                    response.add_post_render_callback(
+                        lambda r: cache.set(key, r, settings.BLOG_PAGE_CACHE_TIMEOUT)
+                    )
+                else:
+                    cache.set(key, response, settings.BLOG_PAGE_CACHE_TIMEOUT)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def _answer_from_cache(request, response):
+    # A cached page keeps the validators it was rendered with (see
+    # conditional_page), so revalidations are answered without a query.
+    return get_conditional_response(request, etag=response.get('ETag'),
+                                    last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+                                    response=response)
+
+
+def _page_validators(request, validators, kwargs):
+    """(ETag, Last-Modified timestamp) of the page, or (None, None) when it gets no validators."""
+    if request.method not in ('GET', 'HEAD'):
+        return None, None
+    result = validators(request, **kwargs)
+    if result is None:
+        return None, None
+    fingerprint, last_modified = result
+    etag = quote_etag(hashlib.md5(repr(fingerprint).encode()).hexdigest())
+    return etag, timegm(last_modified.utctimetuple()) if last_modified else None
+
+
+def _with_validators(request, response, etag, last_modified):
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Browsers revalidate before every reuse; the edge follows Surrogate-Control (see EdgeCacheMiddleware).
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional_page(validators):
+    """
+    Send ETag and Last-Modified with the responses of a GET view and answer
+    requests whose copy is current with a 304, before the view renders.
+
+    `validators(request, **kwargs)` returns (fingerprint, last modified
+    datetime) from one cheap query, or None (e.g. for a missing object) to
+    leave the request to the view. The page must be the same for every
+    visitor (see blog/edge.py). Put it under cache_anonymous_page: cached pages then carry the same
+    validators for every worker, and cache hits answer revalidations
+    without a query. Works on both sync and async views.
+    """
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_async_view(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(_page_validators)(request, validators, kwargs)
+                if etag is None:
+                    return await view_func(request, *args, **kwargs)
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = await view_func(request, *args, **kwargs)
+                return _with_validators(request, response, etag, last_modified)
+            return _wrapped_async_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            etag, last_modified = _page_validators(request, validators, kwargs)
+            if etag is None:
+                return view_func(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            return _with_validators(request, response, etag, last_modified)
+        return _wrapped_view
+    return decorator
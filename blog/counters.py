@@ -0,0 +1,28 @@
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, group_field):
+    return Coalesce(Subquery(queryset.values(group_field).annotate(total=Count('id')).values('total')), Value(0))
+
+
+def reconcile_counters(author_model, post_model, comment_model, batch_size=1000):
+    """
+    Recompute Post.approved_comments and Author.published_posts from the
+    source rows, one primary-key range per UPDATE so no lock is held long.
+    Takes the models as arguments so migrations can pass historical ones.
+    """
+    updated = 0
+    approved = _count(comment_model.objects.filter(post=OuterRef('pk'), active=True), 'post')
+    published = _count(post_model.objects.filter(author=OuterRef('pk'), status='published'), 'author')
+    for model, field, expression in ((post_model, 'approved_comments', approved),
+                                     (author_model, 'published_posts', published)):
+        last_pk = 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += (model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+                        .exclude(**{field: expression}).update(**{field: expression}))
+            last_pk = pks[-1]
+    return updated
@@ -0,0 +1,79 @@
+"""
+Edge (reverse proxy / CDN) caching of the public pages.
+
+Public pages render the same HTML for every visitor: the CSRF token and
+the visitor's own bits come from views.visitor. Responses name what they
+show with surrogate keys, the same scopes as the page cache versions
+('feed', 'post:<id>', 'author:<id>'), and bump_versions() purges those
+keys from the edge once the change is committed. Purging goes through the
+backend named by BLOG_PURGE_BACKEND.
+"""
+import json
+import urllib.request
+from abc import ABC, abstractmethod
+
+from django.apps import apps
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def add_surrogate_keys(response, *keys):
+    header = settings.BLOG_SURROGATE_KEY_HEADER
+    current = response.get(header, '').split()
+    response[header] = ' '.join(dict.fromkeys([*current, *keys]))
+    return response
+
+
+class PurgeBackend(ABC):
+    @abstractmethod
+    def purge(self, keys):
+        """Drop the edge cache entries tagged with any of `keys`."""
+
+
+class NullPurgeBackend(PurgeBackend):
+    """For setups without a reverse proxy."""
+
+    def purge(self, keys):
+        pass
+
+
+class RecordingPurgeBackend(PurgeBackend):
+    """Keeps the purged keys in RecordingPurgeBackend.purged, like the locmem e-mail outbox."""
+    purged = []
+
+    def purge(self, keys):
+        self.purged.append(list(keys))
+
+
+class FastlyPurgeBackend(PurgeBackend):
+    """Soft-purge by surrogate key through the Fastly API, up to 256 keys per request."""
+    batch_size = 256
+
+    def __init__(self, service_id, api_token, timeout=5):
+        self.url = f'https://api.fastly.com/service/{service_id}/purge'
+        self.api_token = api_token
+        self.timeout = timeout
+
+    def purge(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), self.batch_size):
+            request = urllib.request.Request(self.url, method='POST', headers={
+                'Fastly-Key': self.api_token,
+                'Fastly-Soft-Purge': '1',
+                'Content-Type': 'application/json',
+            }, data=json.dumps({'surrogate_keys': keys[start:start + self.batch_size]}).encode())
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+
+
+def get_purge_backend():
+    return import_string(settings.BLOG_PURGE_BACKEND)(**settings.BLOG_PURGE_OPTIONS)
+
+
+def purge_on_commit(*keys):
+    """Purge `keys` in a Celery task, queued through the outbox once the current transaction commits."""
+    # Without a reverse proxy there is nothing to purge: don't queue a task per save.
+    if not keys or issubclass(import_string(settings.BLOG_PURGE_BACKEND), NullPurgeBackend):
+        return
+    # Looked up by name: blog.models imports this module through blog.cache.
+    apps.get_model('blog', 'OutboxMessage').objects.add('blog.tasks.purge_surrogate_keys', sorted(set(keys)))
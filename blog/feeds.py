@@ -0,0 +1,164 @@
+import hashlib
+import json
+from calendar import timegm
+
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date
+from django.utils.xmlutils import SimplerXMLGenerator
+
+
+FEED_SIZE = 20
+FEED_FIELDS = ('id', 'title', 'slug', 'short_description_html', 'publish', 'updated', 'author__username')
+JSON_FEED_VERSION = 'https://jsonfeed.org/version/1.1'
+FEED_FORMATS = {
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+    'json': 'application/feed+json; charset=utf-8',
+}
+
+
+class _Chunks(list):
+    """File-like sink for SimplerXMLGenerator, which writes encoded bytes to it."""
+    write = list.append
+
+
+class StreamingFeedMixin:
+    """
+    Write a feedgenerator feed item by item instead of into one string.
+    Subclasses split the format's write() into write_head()/write_tail().
+    """
+    item_element = None
+
+    def __init__(self, *args, last_modified=None, **kwargs):
+        super(StreamingFeedMixin, self).__init__(*args, **kwargs)
+        self.last_modified = last_modified
+
+    def latest_post_date(self):
+        # Items are not kept on the feed, so the caller tells the date.
+        return self.last_modified or super(StreamingFeedMixin, self).latest_post_date()
+
+    def stream(self, items, encoding='utf-8'):
+        chunks = _Chunks()
+        handler = SimplerXMLGenerator(chunks, encoding, short_empty_elements=True)
+        self.write_head(handler)
+        yield b''.join(chunks)
+        for kwargs in items:
+            chunks.clear()
+            # add_item() fills in the defaults of every optional item field.
+            self.add_item(**kwargs)
+            item = self.items.pop()
+            handler.startElement(self.item_element, self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(self.item_element)
+            yield b''.join(chunks)
+        chunks.clear()
+        self.write_tail(handler)
+        yield b''.join(chunks)
+
+
+class RssFeed(StreamingFeedMixin, Rss201rev2Feed):
+    item_element = 'item'
+
+    def write_head(self, handler):
+        handler.startDocument()
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_tail(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+
+
+class AtomFeed(StreamingFeedMixin, Atom1Feed):
+    item_element = 'entry'
+
+    def write_head(self, handler):
+        handler.startDocument()
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_tail(self, handler):
+        handler.endElement('feed')
+
+
+def stream_json_feed(title, link, feed_url, description, items):
+    """JSON Feed 1.1 document, item by item."""
+    head = json.dumps({'version': JSON_FEED_VERSION, 'title': title, 'home_page_url': link, 'feed_url': feed_url,
+                       'description': description, 'language': 'ru'}, ensure_ascii=False)
+    yield head[:-1] + ', "items": ['
+    for index, item in enumerate(items):
+        entry = {
+            'id': item['unique_id'],
+            'url': item['link'],
+            'title': item['title'],
+            'content_html': item['description'],
+            'date_published': item['pubdate'].isoformat(),
+            'date_modified': item['updateddate'].isoformat(),
+            'authors': [{'name': item['author_name'], 'url': item['author_link']}],
+        }
+        yield (',' if index else '') + json.dumps(entry, ensure_ascii=False)
+    yield ']}'
+
+
+def feed_validators(queryset):
+    """
+    ETag and Last-Modified of the feed of `queryset`: one narrow query over
+    the ids and `updated` of the FEED_SIZE newest rows, so edits, deletions
+    and unpublished posts all change the ETag.
+    """
+    rows = list(queryset.order_by('-publish', '-id').values_list('id', 'updated')[:FEED_SIZE])
+    etag = quote_etag(hashlib.md5(repr(rows).encode()).hexdigest())
+    last_modified = max((updated for _, updated in rows), default=None)
+    return etag, last_modified
+
+
+def feed_items(request, posts):
+    for post in posts:
+        link = request.build_absolute_uri(post.get_absolute_url())
+        yield {
+            'title': post.title,
+            'link': link,
+            'unique_id': link,
+            'description': post.short_description_html,
+            'pubdate': post.publish,
+            'updateddate': post.updated,
+            'author_name': post.author.username,
+            'author_link': request.build_absolute_uri(reverse('blog:post_by_auth', args=[post.author_id])),
+        }
+
+
+def feed_response(request, queryset, feed_format, describe):
+    """
+    Streamed RSS, Atom or JSON feed of the newest posts of `queryset`, or a
+    304 when the client's copy is current. `describe()` returns the feed's
+    title, link and description and is only called for a full response.
+    """
+    if feed_format not in FEED_FORMATS:
+        raise Http404('Неизвестный формат ленты')
+    etag, last_modified = feed_validators(queryset)
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        title, link, description = describe()
+        link = request.build_absolute_uri(link)
+        # Django 4.0's ASGI handler iterates streamed content on the event loop,
+        # where queries are not allowed: fetch the rows here, stream the writing.
+        posts = list(queryset.select_related('author').only(*FEED_FIELDS)
+                     .order_by('-publish', '-id')[:FEED_SIZE])
+        items = feed_items(request, posts)
+        if feed_format == 'json':
+            content = stream_json_feed(title, link, request.build_absolute_uri(), description, items)
+        else:
+            feed_class = RssFeed if feed_format == 'rss' else AtomFeed
+            feed = feed_class(title, link, description, language='ru', feed_url=request.build_absolute_uri(),
+                              last_modified=last_modified)
+            content = feed.stream(items)
+        response = StreamingHttpResponse(content, content_type=FEED_FORMATS[feed_format])
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
@@ -30,6 +30,11 @@ class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ['name', 'email', 'body']
+        # Pre-filled for signed-in visitors by visitor.js, so the page itself stays the same for everyone.
+        widgets = {
+            'name': forms.TextInput(attrs={'data-visitor-field': 'username'}),
+            'email': forms.EmailInput(attrs={'data-visitor-field': 'email'}),
+        }
 
 
 class ContactForm(forms.Form):
@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from django.core.files.base import ContentFile
+
+
+# Derivatives are stored next to the original as `<name>__<width>w.<ext>`.
+VARIANT_WIDTHS = (320, 640, 1024)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+VARIANT_QUALITY = 80
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+def variants_stale(instance, field_name):
+    """True when the variants were built for another file (or never), or remain after the image was cleared."""
+    image = getattr(instance, field_name)
+    return getattr(instance, variants_field(field_name)).get('source') != (image.name if image else None)
+
+
+def generate_variants(field_file):
+    """
+    Write resized WebP and JPEG copies of `field_file` to its storage and
+    return the variants description stored in the `<field>_variants` column.
+    """
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+
+    root = os.path.splitext(field_file.name)[0]
+    widths = [width for width in VARIANT_WIDTHS if width < original.width] or [original.width]
+    variants = []
+    for width in widths:
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for extension, (pil_format, _) in VARIANT_FORMATS.items():
+            image = resized
+            if pil_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, pil_format, quality=VARIANT_QUALITY, optimize=True)
+            name = f'{root}__{width}w.{extension}'
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(buffer.getvalue()))
+            variants.append([width, extension, name])
+    return {'source': field_file.name, 'variants': variants}
+
+
+def delete_variants(storage, description, keep=None):
+    """Delete the files of a variants description, except those `keep` lists too."""
+    kept = {name for width, extension, name in (keep or {}).get('variants', ())}
+    for width, extension, name in description.get('variants', ()):
+        if name not in kept:
+            storage.delete(name)
+
+
+def srcsets(field_file, description):
+    """Return {extension: srcset} for a variants description, or {} if it is stale."""
+    if not field_file or description.get('source') != field_file.name:
+        return {}
+    storage = field_file.storage
+    result = {}
+    for width, extension, name in description['variants']:
+        result.setdefault(extension, []).append(f'{storage.url(name)} {width}w')
+    return {extension: ', '.join(candidates) for extension, candidates in result.items()}
@@ -0,0 +1,105 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from ... import benchmark
+
+
+FILE_SYSTEM_STORAGE = 'django.core.files.storage.FileSystemStorage'
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database and report queries, latency and size of every blog URL'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=10_000)
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--requests', type=int, default=20, help='Requests per URL')
+        parser.add_argument('--warm-cache', action='store_true', help='Keep the cache between requests')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the seeded test database')
+        parser.add_argument('--update-budget', action='store_true',
+                            help='Store the measured query counts as the new budget')
+        parser.add_argument('--concurrency', type=int, default=0,
+                            help='Also compare WSGI and ASGI throughput of the public read views '
+                                 'with this many requests in flight')
+        parser.add_argument('--wsgi-workers', type=int, default=1,
+                            help='Threads serving WSGI in the throughput comparison; 1 is a sync gunicorn worker')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Milliseconds added to every query in the throughput comparison')
+        parser.add_argument('--pool-workers', type=lambda value: [int(count) for count in value.split(',')],
+                            default=[], help='Comma-separated thread counts for the connection pool load test')
+        parser.add_argument('--pool-size', type=int, default=5)
+        parser.add_argument('--sessions', action='store_true',
+                            help='Compare feed requests per second with database and cached sessions')
+
+    def handle(self, *args, **options):
+        # Sitemap chunks and any other files the benchmark writes go to a throwaway
+        # directory, never to the configured storage (the live S3 bucket in production).
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, DEFAULT_FILE_STORAGE=FILE_SYSTEM_STORAGE):
+                results, throughput, sessions, pool_load = self.measure(options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(f'{"url":<28}{"queries":>8}{"p50 ms":>10}{"p95 ms":>10}{"bytes":>10}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<28}{result["queries"]:>8}{result["p50_ms"]:>10}'
+                              f'{result["p95_ms"]:>10}{result["bytes"]:>10}')
+
+        if throughput:
+            self.stdout.write(f'\n{"url":<28}{"wsgi rps":>10}{"asgi rps":>10}')
+            for name, result in throughput.items():
+                self.stdout.write(f'{name:<28}{result["wsgi_rps"]:>10}{result["asgi_rps"]:>10}')
+
+        if sessions:
+            self.stdout.write(f'\n{"traffic":<12}{"db sessions rps":>18}{"cached sessions rps":>22}')
+            for traffic, result in sessions.items():
+                self.stdout.write(f'{traffic:<12}{result["db_sessions"]:>18}{result["cached_sessions"]:>22}')
+
+        if pool_load:
+            self.stdout.write(f'\n{"workers":<10}{"persistent":>12}{"pooled":>8}{"wait ms":>10}'
+                              f'{"p95 ms":>10}{"pooled p95 ms":>15}')
+            for workers, result in pool_load.items():
+                self.stdout.write(f'{workers:<10}{result["persistent"]:>12}{result["pooled"]:>8}'
+                                  f'{result["avg_wait_ms"]:>10}{result["persistent_p95_ms"]:>10}'
+                                  f'{result["pooled_p95_ms"]:>15}')
+
+        if options['update_budget']:
+            with open(benchmark.BUDGET_FILE, 'w') as budget_file:
+                json.dump({name: result['queries'] for name, result in results.items()}, budget_file, indent=4)
+                budget_file.write('\n')
+            return
+        errors = benchmark.over_budget(results, benchmark.load_budget())
+        if errors:
+            raise CommandError('Query budget exceeded:\n' + '\n'.join(errors))
+
+    def measure(self, options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'])
+        try:
+            if not benchmark.Post.objects.exists():
+                self.stdout.write('Seeding...')
+                benchmark.seed(options['authors'], options['posts'], options['comments'])
+            results = benchmark.run(options['requests'], options['warm_cache'])
+            throughput = {}
+            if options['concurrency']:
+                throughput = benchmark.run_concurrent(options['requests'] * options['concurrency'],
+                                                      options['concurrency'], options['wsgi_workers'],
+                                                      options['latency'] / 1000, options['warm_cache'])
+            sessions = {}
+            if options['sessions']:
+                sessions = benchmark.run_session_throughput(options['requests'] * 10)
+            pool_load = {}
+            if options['pool_workers']:
+                pool_load = benchmark.run_pool_load(options['pool_workers'], options['requests'],
+                                                    options['pool_size'], (options['latency'] or 5) / 1000)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        return results, throughput, sessions, pool_load
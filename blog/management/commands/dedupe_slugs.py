@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Post
+from ...slugs import dedupe_slugs
+
+
+class Command(BaseCommand):
+    help = 'Give posts with colliding slugs deterministic -N suffixes, in short batched transactions'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        fixed = dedupe_slugs(Post, options['batch_size'])
+        self.stdout.write(f'{fixed} slugs deduplicated')
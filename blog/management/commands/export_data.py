@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bulk import BATCH_SIZE, FIELDS, export_rows, format_of, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream authors, posts or comments to a JSONL or CSV file, one keyset query per batch'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(FIELDS))
+        parser.add_argument('path', help='.jsonl or .csv file, or - for standard output')
+        parser.add_argument('--format', dest='file_format', help='jsonl or csv, instead of the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = format_of(path, options['file_format'])
+        except ValueError as error:
+            raise CommandError(error)
+        start = time.perf_counter()
+        rows = export_rows(options['kind'], options['batch_size'])
+        if path == '-':
+            written = write_rows(rows, self.stdout, file_format, FIELDS[options['kind']])
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as stream:
+                written = write_rows(rows, stream, file_format, FIELDS[options['kind']])
+        elapsed = time.perf_counter() - start
+        # The report goes to stderr, so it never ends up in an export written to stdout.
+        self.stderr.write(f'{options["kind"]}: {written} exported in {elapsed:.1f}s '
+                          f'({written / elapsed:.0f} rows/s)', style_func=self.style.SUCCESS)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from ...images import variants_field, variants_stale
+from ...models import Author, Post
+from ...tasks import generate_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Build missing or stale WebP/JPEG derivatives of post images and profile photos'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue one Celery task per image instead of resizing here')
+
+    def handle(self, *args, **options):
+        for model, field_name in ((Post, 'post_image'), (Author, 'profile_photo')):
+            queryset = model.objects.exclude(**{field_name: ''}).only('pk', field_name, variants_field(field_name))
+            done = 0
+            for instance in queryset.iterator(chunk_size=500):
+                if not variants_stale(instance, field_name):
+                    continue
+                if options['run_async']:
+                    generate_image_variants.delay(model._meta.label, instance.pk, field_name)
+                else:
+                    generate_image_variants(model._meta.label, instance.pk, field_name)
+                done += 1
+            self.stdout.write(f'{model._meta.label}.{field_name}: {done} images processed')
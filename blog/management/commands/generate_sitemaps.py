@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...sitemaps import generate_sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the sitemap chunks whose posts or authors changed, and the sitemap index'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild every chunk')
+
+    def handle(self, *args, **options):
+        written = generate_sitemaps(force=options['force'])
+        self.stdout.write(f'{len(written)} sitemap chunks written')
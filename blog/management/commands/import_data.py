@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bulk import BATCH_SIZE, FIELDS, format_of, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk insert authors, posts or comments from a JSONL or CSV file, sending no notifications'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(FIELDS),
+                            help='Import authors before their posts and posts before their comments')
+        parser.add_argument('path', help='.jsonl or .csv file, or - for standard input')
+        parser.add_argument('--format', dest='file_format', help='jsonl or csv, instead of the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = format_of(path, options['file_format'])
+        except ValueError as error:
+            raise CommandError(error)
+        if path == '-':
+            imported, skipped, elapsed = self.load(sys.stdin, file_format, options)
+        else:
+            with open(path, newline='', encoding='utf-8') as stream:
+                imported, skipped, elapsed = self.load(stream, file_format, options)
+        self.stdout.write(f'{options["kind"]}: {imported} imported, {skipped} skipped in {elapsed:.1f}s '
+                          f'({(imported + skipped) / elapsed:.0f} rows/s)')
+
+    def load(self, stream, file_format, options):
+        start = time.perf_counter()
+
+        def progress(imported, skipped):
+            if options['verbosity'] > 1:
+                rows = imported + skipped
+                self.stdout.write(f'{rows} rows, {rows / (time.perf_counter() - start):.0f} rows/s')
+
+        imported, skipped = import_rows(options['kind'], read_rows(stream, file_format),
+                                        options['batch_size'], progress)
+        return imported, skipped, time.perf_counter() - start
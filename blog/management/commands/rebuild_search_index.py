@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute full-text search data of every post'  # noqa: A003
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write('Search index rebuilt')
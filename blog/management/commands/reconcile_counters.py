@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...counters import reconcile_counters
+from ...models import Author, Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Fix drift of the denormalized comment and post counters in batches'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters(Author, Post, Comment, options['batch_size'])
+        self.stdout.write(f'{fixed} counters fixed')
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from ...models import OutboxMessage
+
+
+class Command(BaseCommand):
+    help = 'Publish the Celery tasks queued in the outbox to the broker in batches'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.BLOG_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, polling the outbox every INTERVAL seconds (once otherwise)')
+
+    def handle(self, *args, **options):
+        if options['interval'] is None:
+            try:
+                published = OutboxMessage.objects.relay(options['batch_size'])
+            except Exception as error:
+                raise CommandError(f'Broker unavailable, tasks left in the outbox: {error}')
+            self.stdout.write(f'{published} tasks published')
+            return
+        while True:
+            try:
+                published = OutboxMessage.objects.relay(options['batch_size'])
+            except Exception as error:
+                # Retried on the next poll; the unpublished rows stay in the outbox.
+                self.stderr.write(f'Broker unavailable: {error}')
+                published = 0
+            if published and options['verbosity'] > 1:
+                self.stdout.write(f'{published} tasks published')
+            # Between polls, like between requests: drop connections that died or aged out.
+            close_old_connections()
+            # A full batch means more were probably queued meanwhile: poll again right away.
+            if published < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ...cache import bump_versions
+from ...models import Comment, Post
+from ...rendering import MARKDOWN_RENDERER_VERSION
+
+
+def touch_posts(posts):
+    """New validators and cache versions for the re-rendered posts, like any other edit."""
+    now = timezone.now()
+    for post in posts:
+        post.updated = now
+    bump_versions('feed', *(scope for post in posts
+                            for scope in (f'post:{post.pk}', f'author:{post.author_id}', f'slug:{post.slug}')))
+
+
+def touch_comments(comments):
+    """Only approved comments are shown: move their posts' comments_updated and versions."""
+    post_ids = {comment.post_id for comment in comments if comment.active}
+    if not post_ids:
+        return
+    Post.objects.filter(pk__in=post_ids).update(comments_updated=timezone.now())
+    bump_versions(*(scope for pk, slug in Post.objects.filter(pk__in=post_ids).values_list('pk', 'slug')
+                    for scope in (f'post:{pk}', f'slug:{slug}')))
+
+
+class Command(BaseCommand):
+    help = 'Re-render stored Markdown HTML of posts and comments rendered by an older renderer version'  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render every row, not only stale ones')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for label, model, fields, touch in (
+            ('posts', Post, ['short_description_html', 'body_html', 'rendered_version', 'updated'], touch_posts),
+            ('comments', Comment, ['body_html', 'rendered_version'], touch_comments),
+        ):
+            queryset = model.objects.all()
+            if not options['all']:
+                queryset = queryset.exclude(rendered_version=MARKDOWN_RENDERER_VERSION)
+            total = self.rerender(queryset, fields, touch, options['batch_size'])
+            self.stdout.write(f'{label}: {total} re-rendered')
+
+    def rerender(self, queryset, fields, touch, batch_size):
+        total = 0
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                return total
+            for obj in batch:
+                obj.render_markdown()
+            with transaction.atomic():
+                touch(batch)
+                queryset.model.objects.bulk_update(batch, fields)
+            total += len(batch)
+            last_pk = batch[-1].pk
@@ -0,0 +1,289 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.cache import has_vary_header, patch_cache_control
+
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .routers import PIN_COOKIE, use_primary
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('db_queries', 'db_time', 'template_time', 'template_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class StatsRegistry:
+    """In-process totals per URL name; each worker process keeps its own."""
+
+    fields = ('requests', 'total_time', 'db_queries', 'db_time', 'template_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, name, total_time, stats):
+        with self._lock:
+            totals = self._totals.setdefault(name, dict.fromkeys(self.fields, 0))
+            totals['requests'] += 1
+            totals['total_time'] += total_time
+            totals['db_queries'] += stats.db_queries
+            totals['db_time'] += stats.db_time
+            totals['template_time'] += stats.template_time
+            totals['cache_hits'] += stats.cache_hits
+            totals['cache_misses'] += stats.cache_misses
+
+    def snapshot(self):
+        """Totals and per-request averages (times in milliseconds) per URL name."""
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        report = {}
+        for name, values in totals.items():
+            requests = values['requests']
+            report[name] = {
+                'requests': requests,
+                'avg_total_ms': round(values['total_time'] * 1000 / requests, 2),
+                'avg_db_queries': round(values['db_queries'] / requests, 2),
+                'avg_db_ms': round(values['db_time'] * 1000 / requests, 2),
+                'avg_template_ms': round(values['template_time'] * 1000 / requests, 2),
+                'cache_hits': values['cache_hits'],
+                'cache_misses': values['cache_misses'],
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+
+registry = StatsRegistry()
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    # Async views query from worker threads, each with its own connection
+    # object: install the wrapper on every connection as it is opened. First
+    # in the list, so the pop() of a connection.execute_wrapper() block opened
+    # before the connection still removes that block's own wrapper.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+def timed_render(render, *args):
+    """Call render(*args), adding its time to the current request's template time."""
+    stats = _current.get()
+    if stats is None:
+        return render(*args)
+    # Templates rendered from inside another one (tags calling render_to_string): only time the outermost one.
+    stats.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return render(*args)
+    finally:
+        stats.template_depth -= 1
+        if not stats.template_depth:
+            stats.template_time += time.perf_counter() - start
+
+
+def count_cache_lookups(hits, misses):
+    """Add page and version cache lookups (see blog/cache.py) to the current request's stats."""
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+class PerformanceMiddleware:
+    """
+    Record DB query count and time, template render time, cache hits and
+    misses and wall time of every request, aggregated per resolved URL name
+    (see `performance_stats`) and, with BLOG_SERVER_TIMING, reported in a
+    Server-Timing header.
+
+    Template time needs the blog.templating.DjangoTemplates backend.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function so Django keeps the chain async.
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_timer, dispatch_uid='blog.middleware.query_timer')
+        for connection in connections.all():
+            _install_query_timer(None, connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, total_time):
+        match = getattr(request, 'resolver_match', None)
+        registry.add(match.view_name if match else '<unresolved>', total_time, stats)
+        if settings.BLOG_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_queries} queries"',
+                f'tpl;dur={stats.template_time * 1000:.1f}',
+                f'cache;desc="{stats.cache_hits} hits, {stats.cache_misses} misses"',
+                f'total;dur={total_time * 1000:.1f}',
+            ])
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise 6 middleware is sync-only, and a single sync-only middleware
+    makes Django run the whole chain below it in a thread under ASGI. This
+    subclass serves static files the same way in both modes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super(StaticFilesMiddleware, self).__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super(StaticFilesMiddleware, self).__call__(request)
+
+    async def __acall__(self, request):
+        # File lookup is a dict access unless autorefresh (DEBUG) scans the disk.
+        if self.autorefresh:
+            response = await sync_to_async(self.process_request, thread_sensitive=False)(request)
+        else:
+            response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class PrimaryPinningMiddleware:
+    """
+    Run requests that write, and the visitor's requests for
+    BLOG_PRIMARY_PIN_SECONDS after one, against the primary database, so
+    the page shown after a comment or an edit never comes from a replica
+    that has not caught up yet.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.pinned(request):
+            return self.get_response(request)
+        with use_primary():
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if not self.pinned(request):
+            return await self.get_response(request)
+        with use_primary():
+            response = await self.get_response(request)
+        return self.finish(request, response)
+
+    def pinned(self, request):
+        return bool(settings.BLOG_READ_REPLICAS) and (request.method not in self.safe_methods
+                                                      or PIN_COOKIE in request.COOKIES)
+
+    def finish(self, request, response):
+        if request.method not in self.safe_methods and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.BLOG_PRIMARY_PIN_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+class EdgeCacheMiddleware:
+    """
+    Let the reverse proxy keep responses tagged with surrogate keys for
+    BLOG_EDGE_CACHE_SECONDS (Surrogate-Control, which the proxy strips),
+    unless they turned out to depend on the visitor: set a cookie or read
+    the session (Vary: Cookie). Those lose their keys and become private.
+    So do pages rendered for a visitor pinned to the primary (PIN_COOKIE):
+    the proxy must also pass such requests through instead of answering
+    them from its cache (see README). Must come before SessionMiddleware,
+    so it sees the final headers.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.finish(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.finish(request, await self.get_response(request))
+
+    def finish(self, request, response):
+        header = settings.BLOG_SURROGATE_KEY_HEADER
+        if not response.has_header(header):
+            return response
+        if response.cookies or has_vary_header(response, 'Cookie') or PIN_COOKIE in request.COOKIES:
+            del response[header]
+            patch_cache_control(response, private=True)
+        else:
+            response['Surrogate-Control'] = f'max-age={settings.BLOG_EDGE_CACHE_SECONDS}'
+        return response
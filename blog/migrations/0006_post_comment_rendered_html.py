@@ -0,0 +1,55 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+from blog.rendering import MARKDOWN_RENDERER_VERSION, render_markdown
+
+
+def render_existing(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    for post in Post.objects.iterator():
+        post.short_description_html = render_markdown(post.short_description)
+        post.body_html = render_markdown(post.body)
+        post.rendered_version = MARKDOWN_RENDERER_VERSION
+        post.save(update_fields=['short_description_html', 'body_html', 'rendered_version'])
+    for comment in Comment.objects.iterator():
+        comment.body_html = render_markdown(comment.body)
+        comment.rendered_version = MARKDOWN_RENDERER_VERSION
+        comment.save(update_fields=['body_html', 'rendered_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_alter_comment_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='rendered_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rendered_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='short_description_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+from blog.slugs import dedupe_slugs
+
+
+def dedupe_post_slugs(apps, schema_editor):
+    # Normally a no-op: run `./manage.py dedupe_slugs` on live data beforehand.
+    dedupe_slugs(apps.get_model('blog', 'Post'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_comment_rendered_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_post_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(max_length=250, unique=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:33
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_first_published(apps, schema_editor):
+    # Already published posts must not be announced again on their next edit.
+    Post = apps.get_model('blog', 'Post')
+    Post.objects.filter(status='published').update(first_published=models.F('publish'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='first_published',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата первой публикации'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='publish',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата публикации'),
+        ),
+        migrations.RunPython(backfill_first_published, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_first_published'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='profile_photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='post_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# See blog/search.py: Postgres gets a trigger-maintained tsvector column with a
+# GIN index, SQLite an FTS5 table kept in sync by Post.save/delete.
+
+POSTGRES_FORWARDS = [
+    'ALTER TABLE blog_post ADD COLUMN search_vector tsvector',
+    """
+    CREATE FUNCTION blog_post_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(NEW.short_description, '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(NEW.body, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER blog_post_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, short_description, body ON blog_post
+        FOR EACH ROW EXECUTE PROCEDURE blog_post_search_vector_update()
+    """,
+    'UPDATE blog_post SET title = title',
+    'CREATE INDEX blog_post_search_vector_gin ON blog_post USING gin (search_vector)',
+]
+
+POSTGRES_BACKWARDS = [
+    'DROP TRIGGER blog_post_search_vector_trigger ON blog_post',
+    'DROP FUNCTION blog_post_search_vector_update()',
+    'ALTER TABLE blog_post DROP COLUMN search_vector',
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE blog_post_fts USING fts5("
+    "title, short_description, body, tokenize='unicode61 remove_diacritics 2')",
+    'INSERT INTO blog_post_fts (rowid, title, short_description, body) '
+    'SELECT id, title, short_description, body FROM blog_post',
+]
+
+SQLITE_BACKWARDS = [
+    'DROP TABLE blog_post_fts',
+]
+
+
+def run_for_vendor(postgres_statements, sqlite_statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        statements = {'postgresql': postgres_statements, 'sqlite': sqlite_statements}.get(vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(POSTGRES_FORWARDS, SQLITE_FORWARDS),
+            run_for_vendor(POSTGRES_BACKWARDS, SQLITE_BACKWARDS),
+        ),
+    ]
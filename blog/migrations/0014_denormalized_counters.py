@@ -0,0 +1,31 @@
+# Generated by Django 4.0.5 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+from blog.counters import reconcile_counters
+
+
+def fill_counters(apps, schema_editor):
+    reconcile_counters(apps.get_model('blog', 'Author'), apps.get_model('blog', 'Post'),
+                       apps.get_model('blog', 'Comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='published_posts',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Опубликовано постов'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='approved_comments',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.5 on 2026-10-18 08:53
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def fill_comments_updated(apps, schema_editor):
+    # What post_detail sent as Last-Modified so far: the newest approved comment edit.
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    newest = Comment.objects.filter(post=OuterRef('pk'), active=True).order_by().values('post') \
+        .annotate(newest=Max('updated')).values('newest')
+    Post.objects.update(comments_updated=Subquery(newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_comments_updated, migrations.RunPython.noop),
+    ]
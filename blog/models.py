@@ -1,11 +1,41 @@
+import json
+import logging
+from collections import Counter
+
+from celery import current_app
+
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, models, transaction
 from django.urls import reverse
+from django.utils import timezone
 
 from pytils import translit
 
-from .tasks import comment_active, new_post
+from .cache import bump_versions
+from .notifications import ADMIN_EMAIL, build_digests
+from .rendering import MARKDOWN_RENDERER_VERSION, render_markdown
+from .routers import use_primary
+from .search import index_post, unindex_post
+from .slugs import unique_slug
+from .tasks import schedule_image_variants
+
+
+logger = logging.getLogger(__name__)
+
+
+def exclude_counters(instance, kwargs, *counters):
+    """
+    Keep a full save() of an existing row from overwriting counters maintained
+    with F() updates. Like Model.save(), leave out the fields the instance
+    deferred: saving a slim request.user must not load each of them first.
+    """
+    if not instance._state.adding and kwargs.get('update_fields') is None:
+        deferred = instance.get_deferred_fields()
+        kwargs['update_fields'] = [field.name for field in instance._meta.concrete_fields
+                                   if not field.primary_key and field.name not in counters
+                                   and field.attname not in deferred]
 
 
 class Author(AbstractUser):
@@ -13,10 +43,41 @@ class Author(AbstractUser):
     email = models.EmailField(unique=True)
     is_staff = models.BooleanField(default=False)
     description = models.TextField(max_length=200, verbose_name='Описание', blank=True)
+    profile_photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    published_posts = models.PositiveIntegerField(default=0, editable=False, verbose_name='Опубликовано постов')
 
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Author, cls).from_db(db, field_names, values)
+        instance._loaded_username = dict(zip(field_names, values)).get('username')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Profile edits, not the last_login updates of every sign-in.
+        edited = not self._state.adding and kwargs.get('update_fields') is None
+        renamed = edited and self.username != getattr(self, '_loaded_username', None)
+        exclude_counters(self, kwargs, 'published_posts')
+        with transaction.atomic(savepoint=False):
+            super(Author, self).save(*args, **kwargs)
+            # A slim request.user (blog.auth) did not load the photo, so did not change it either.
+            if 'profile_photo' not in self.get_deferred_fields():
+                schedule_image_variants(self, 'profile_photo')
+            if edited:
+                # The detail pages of the author's posts show the username.
+                bump_versions(f'author:{self.pk}', *(f'slug:{slug}' for slug in
+                                                     Post.objects.filter(author=self).values_list('slug', flat=True)))
+            if renamed:
+                # So does every feed page with one of their posts.
+                bump_versions('feed')
+        self._loaded_username = self.username
+
+
+# Saves of a post that retry with a new slug after losing a race for one.
+SLUG_ATTEMPTS = 5
+
 
 class PublishedManager(models.Manager):
     def get_queryset(self):
@@ -30,22 +91,42 @@ class Post(models.Model):
     )
     title = models.CharField(max_length=250, unique=True, verbose_name='Заголовок')
     post_image = models.ImageField(blank=True, verbose_name='Фото поста', upload_to='posts_photo/')
-    slug = models.SlugField(max_length=250)
+    post_image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    slug = models.SlugField(max_length=250, unique=True)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='author', verbose_name='Автор')
     short_description = models.CharField(max_length=500, verbose_name='Краткое описание')
     body = models.TextField(verbose_name='Текст')
-    publish = models.DateTimeField(auto_now=True, verbose_name='Дата публикации')
+    short_description_html = models.TextField(blank=True, editable=False)
+    body_html = models.TextField(blank=True, editable=False)
+    rendered_version = models.PositiveSmallIntegerField(default=0, editable=False)
+    publish = models.DateTimeField(default=timezone.now, verbose_name='Дата публикации')
+    first_published = models.DateTimeField(null=True, blank=True, editable=False,
+                                           verbose_name='Дата первой публикации')
     created = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated = models.DateTimeField(auto_now=True, verbose_name='Дата редактирования')
     status = models.CharField(max_length=10,
                               choices=status_choices,
                               default='draft',
                               verbose_name='Статут публикации')
+    approved_comments = models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев')
+    # Last approval, edit, withdrawal or deletion of an approved comment: with
+    # `updated`, the detail page's Last-Modified, which never goes backwards.
+    comments_updated = models.DateTimeField(null=True, blank=True, editable=False)
     objects = models.Manager()
     published = PublishedManager()
 
     class Meta:
         ordering = ('-publish',)
+        indexes = [
+            models.Index(fields=['-publish', '-id']),
+            # PublishedManager feed and post_by_auth for visitors.
+            models.Index(fields=['-publish', '-id'], condition=models.Q(status='published'),
+                         name='post_published_feed_idx'),
+            models.Index(fields=['author', '-publish', '-id'], condition=models.Q(status='published'),
+                         name='post_published_author_idx'),
+            # post_by_auth for the author, drafts included.
+            models.Index(fields=['author', '-publish', '-id'], name='post_author_feed_idx'),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
@@ -56,14 +137,147 @@ class Post(models.Model):
         return reverse('blog:post_detail',
                        args=[self.slug])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Post, cls).from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_status = loaded.get('status')
+        instance._loaded_title = loaded.get('title')
+        instance._loaded_slug = loaded.get('slug')
+        instance._loaded_author_id = loaded.get('author_id')
+        return instance
+
+    def render_markdown(self):
+        self.short_description_html = render_markdown(self.short_description)
+        self.body_html = render_markdown(self.body)
+        self.rendered_version = MARKDOWN_RENDERER_VERSION
+
+    def _free_slug(self):
+        # On the primary: a lagging replica would hand out slugs taken meanwhile.
+        with use_primary():
+            return unique_slug(Post.objects.exclude(pk=self.pk), translit.translify(self.title),
+                               self._meta.get_field('slug').max_length)
+
+    def _save_with_free_slug(self, *args, **kwargs):
+        """
+        save(), retried with the next free slug when a concurrent save took
+        this one between the lookup and the INSERT/UPDATE. Each attempt runs
+        in a savepoint, so a surrounding transaction stays usable.
+        """
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super(Post, self).save(*args, **kwargs)
+            except IntegrityError:
+                with use_primary():
+                    taken = Post.objects.exclude(pk=self.pk).filter(slug=self.slug).exists()
+                if not taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+                self.slug = self._free_slug()
+
     def save(self, *args, **kwargs):
-        self.slug = translit.translify(self.title)
-        super(Post, self).save(*args, **kwargs)
-        link = self.get_absolute_url()
-        if self.status == 'published':
-            message = f'Новый пост. Название: {self.title} автора {self.author}. ' \
-                      f'Ссылка на пост: {settings.SCHEMA}://{settings.DOMAIN}{link}'
-            new_post.delay("New post", message)
+        if not self.slug or self._state.adding or self.title != getattr(self, '_loaded_title', None):
+            self.slug = self._free_slug()
+        self.render_markdown()
+        # Only the first draft -> published transition announces the post;
+        # later edits keep their place in the feed and send nothing.
+        just_published = self.status == 'published' and self.first_published is None
+        if just_published:
+            self.publish = self.first_published = timezone.now()
+        was_published = getattr(self, '_loaded_status', None) == 'published'
+        loaded_author_id = getattr(self, '_loaded_author_id', None) or self.author_id
+        loaded_slug = getattr(self, '_loaded_slug', None) or self.slug
+        exclude_counters(self, kwargs, 'approved_comments', 'comments_updated')
+        # The row, its counters and search entry, and the queued tasks and
+        # notification commit or roll back together, in autocommit mode too.
+        with transaction.atomic(savepoint=False):
+            self._save_with_free_slug(*args, **kwargs)
+            # A published post handed to another author moves from one count to the other.
+            deltas = Counter()
+            if was_published:
+                deltas[loaded_author_id] -= 1
+            if self.status == 'published':
+                deltas[self.author_id] += 1
+            deltas = {author_id: delta for author_id, delta in deltas.items() if delta}
+            if deltas:
+                add_published_posts(deltas)
+            index_post(self)
+            bump_versions('feed', f'post:{self.pk}', f'author:{self.author_id}', f'author:{loaded_author_id}',
+                          f'slug:{self.slug}', f'slug:{loaded_slug}')
+            schedule_image_variants(self, 'post_image')
+            if just_published:
+                link = self.get_absolute_url()
+                message = f'Новый пост. Название: {self.title} автора {self.author}. ' \
+                          f'Ссылка на пост: {settings.SCHEMA}://{settings.DOMAIN}{link}'
+                Notification.objects.enqueue("New post", message, [ADMIN_EMAIL])
+        self._loaded_status = self.status
+        self._loaded_title = self.title
+        self._loaded_slug = self.slug
+        self._loaded_author_id = self.author_id
+
+    def delete(self, *args, **kwargs):
+        # The stored row counts for the author it was loaded with.
+        author_id = getattr(self, '_loaded_author_id', None) or self.author_id
+        slug = getattr(self, '_loaded_slug', None) or self.slug
+        scopes = ('feed', f'post:{self.pk}', f'author:{author_id}', f'author:{self.author_id}', f'slug:{slug}')
+        pk = self.pk
+        was_published = getattr(self, '_loaded_status', self.status) == 'published'
+        with transaction.atomic(savepoint=False):
+            result = super(Post, self).delete(*args, **kwargs)
+            if was_published:
+                add_published_posts({author_id: -1})
+            unindex_post(pk)
+            bump_versions(*scopes)
+        return result
+
+
+def _shift_counter(model, field, deltas, **changes):
+    delta = models.Case(*(models.When(pk=pk, then=models.Value(value)) for pk, value in deltas.items()),
+                        default=models.Value(0))
+    model.objects.filter(pk__in=list(deltas)).update(**{field: models.F(field) + delta}, **changes)
+
+
+def add_published_posts(deltas):
+    """Shift Author.published_posts by an {author_id: delta} mapping with one UPDATE."""
+    _shift_counter(Author, 'published_posts', deltas)
+
+
+def add_approved_comments(deltas):
+    """Shift Post.approved_comments by a {post_id: delta} mapping with one UPDATE, touching comments_updated."""
+    _shift_counter(Post, 'approved_comments', deltas, comments_updated=timezone.now())
+
+
+class CommentQuerySet(models.QuerySet):
+    def approve(self):
+        """
+        Approve the pending comments of this queryset with a single UPDATE and
+        queue the post authors' notifications in one batch.
+        """
+        with transaction.atomic():
+            rows = list(self.filter(active=False).select_for_update(of=('self',)).values(*APPROVAL_FIELDS))
+            if not rows:
+                return 0
+            self.model.objects.filter(id__in=[row['id'] for row in rows]).update(active=True, updated=timezone.now())
+            notify_approved(rows)
+            per_post = Counter(row['post_id'] for row in rows)
+            add_approved_comments(per_post)
+            bump_versions(*(f'post:{post_id}' for post_id in per_post),
+                          *(f'slug:{row["post__slug"]}' for row in rows))
+        return len(rows)
+
+
+APPROVAL_FIELDS = ('id', 'name', 'post_id', 'post__title', 'post__slug', 'post__author__email')
+
+
+def notify_approved(rows):
+    """Queue notifications for approved comment rows holding APPROVAL_FIELDS."""
+    notifications = []
+    for row in rows:
+        link = reverse('blog:post_detail', args=[row['post__slug']])
+        message = f'У вас новый комментарий к посту {row["post__title"]} от {row["name"]}' \
+                  f'Ссылка на пост: {settings.SCHEMA}://{settings.DOMAIN}{link}'
+        notifications.append(("New comment", message, [ADMIN_EMAIL, row['post__author__email']]))
+    Notification.objects.enqueue_many(notifications)
 
 
 class Comment(models.Model):
@@ -73,23 +287,200 @@ class Comment(models.Model):
     name = models.CharField(max_length=80, verbose_name='Ваше имя')
     email = models.EmailField(max_length=250, verbose_name='E-mail')
     body = models.TextField(verbose_name='Сообщение')
+    body_html = models.TextField(blank=True, editable=False)
+    rendered_version = models.PositiveSmallIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=False)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ['created']
         indexes = [
-            models.Index(fields=['created']),
+            models.Index(fields=['created', 'id']),
+            # Approved comment thread of a post.
+            models.Index(fields=['post', 'created', 'id'], condition=models.Q(active=True),
+                         name='comment_active_thread_idx'),
         ]
 
     def __str__(self):
         return f'Comment by {self.name} on {self.post}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Comment, cls).from_db(db, field_names, values)
+        instance._loaded_active = dict(zip(field_names, values)).get('active', False)
+        return instance
+
+    def render_markdown(self):
+        self.body_html = render_markdown(self.body)
+        self.rendered_version = MARKDOWN_RENDERER_VERSION
+
     def save(self, *args, **kwargs):
-        super(Comment, self).save(*args, **kwargs)
-        link = self.post.get_absolute_url()
-        if self.active:
-            message = f'У вас новый комментарий к посту {self.post.title} от {self.name}' \
-                      f'Ссылка на пост: {settings.SCHEMA}://{settings.DOMAIN}{link}'
-            comment_active.delay("New comment", self.post.author.email, message)
+        adding = self._state.adding
+        was_active = getattr(self, '_loaded_active', False)
+        approved = self.active and not was_active
+        self.render_markdown()
+        with transaction.atomic(savepoint=False):
+            super(Comment, self).save(*args, **kwargs)
+            if self.active != was_active:
+                add_approved_comments({self.post_id: 1 if self.active else -1})
+            elif self.active:
+                Post.objects.filter(pk=self.post_id).update(comments_updated=timezone.now())
+            if approved:
+                # The joined notification row also carries the slug of the post's page.
+                rows = list(Comment.objects.filter(pk=self.pk).values(*APPROVAL_FIELDS))
+                notify_approved(rows)
+                bump_versions(f'post:{self.post_id}', f'slug:{rows[0]["post__slug"]}')
+            elif self.active or not adding:
+                bump_versions(f'post:{self.post_id}', f'slug:{self._post_slug()}')
+        self._loaded_active = self.active
+
+    def _post_slug(self):
+        # The loaded post when there is one, otherwise just its slug: not the whole row.
+        if Comment.post.is_cached(self):
+            return self.post.slug
+        return Post.objects.filter(pk=self.post_id).values_list('slug', flat=True).first()
+
+    def delete(self, *args, **kwargs):
+        was_active = getattr(self, '_loaded_active', self.active)
+        with transaction.atomic(savepoint=False):
+            result = super(Comment, self).delete(*args, **kwargs)
+            if was_active:
+                add_approved_comments({self.post_id: -1})
+                bump_versions(f'post:{self.post_id}', f'slug:{self._post_slug()}')
+        return result
+
+
+class NotificationManager(models.Manager):
+    def enqueue(self, subject, message, recipients, from_email=ADMIN_EMAIL):
+        self.enqueue_many([(subject, message, recipients)], from_email=from_email)
+
+    def enqueue_many(self, notifications, from_email=ADMIN_EMAIL):
+        """Queue (subject, message, recipients) tuples with one INSERT."""
+        rows = []
+        for subject, message, recipients in notifications:
+            rows.extend(self.model(subject=subject, message=message, from_email=from_email, recipient=recipient)
+                        for recipient in recipients)
+        if not rows:
+            return
+        with transaction.atomic(savepoint=False):
+            self.bulk_create(rows)
+            # Whether a batch is pending, without counting the whole queue.
+            threshold = settings.BLOG_NOTIFICATION_BATCH_SIZE
+            if self.order_by()[threshold - 1:threshold].exists():
+                OutboxMessage.objects.add('blog.tasks.flush_notifications')
+
+    def flush(self, batch_size=None):
+        """
+        Send pending notifications as per-recipient digests, one connection per
+        batch. If sending stops partway, the digests already sent are deleted
+        before the error is raised, so a retry only sends the rest.
+        """
+        batch_size = batch_size or settings.BLOG_NOTIFICATION_BATCH_SIZE
+        sent = 0
+        while True:
+            error = None
+            with transaction.atomic():
+                batch = list(self.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+                if not batch:
+                    return sent
+                done = []
+                with get_connection() as connection:
+                    for (subject, message, from_email, recipients), ids in build_digests(batch):
+                        try:
+                            sent += connection.send_messages([EmailMessage(subject, message, from_email,
+                                                                           recipients)])
+                        except Exception as exc:  # SMTPException, socket errors, ...
+                            error = exc
+                            break
+                        done.extend(ids)
+                self.filter(id__in=done).delete()
+            if error is not None:
+                raise error
+
+
+class Notification(models.Model):
+    subject = models.CharField(max_length=250)
+    message = models.TextField()
+    from_email = models.EmailField(max_length=250)
+    recipient = models.EmailField(max_length=250)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = NotificationManager()
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Уведомления'
+
+    def __str__(self):
+        return f'{self.subject} to {self.recipient}'
+
+
+class OutboxManager(models.Manager):
+    def add(self, task, *args):
+        """
+        Queue the Celery task `task` (a registered name) with JSON-serializable
+        `args` in the current transaction: it reaches the broker only if the
+        transaction commits, and a slow or unavailable broker never fails it.
+        """
+        message = self.create(task=task, args=list(args))
+        if settings.BLOG_OUTBOX_RELAY_ON_COMMIT:
+            transaction.on_commit(lambda: self._relay_now(message.pk))
+        return message
+
+    def _relay_now(self, pk):
+        try:
+            self.relay(ids=[pk])
+        except Exception:
+            logger.exception('Outbox message %s left for relay_outbox', pk)
+
+    def relay(self, batch_size=None, ids=None):
+        """
+        Publish queued tasks in id order, one transaction per batch, and delete
+        them; return how many were published. Identical messages of a batch are
+        published once. A publish error stops the relay and is raised after the
+        messages published so far are deleted, so the next run resumes with the
+        failed one. Delivery is at least once: a crash between publishing and
+        the commit publishes the batch again, which the tasks tolerate.
+        """
+        batch_size = batch_size or settings.BLOG_OUTBOX_BATCH_SIZE
+        queryset = self.all() if ids is None else self.filter(id__in=ids)
+        published = 0
+        while True:
+            error = None
+            with transaction.atomic():
+                batch = list(queryset.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+                if not batch:
+                    return published
+                done, seen = [], set()
+                for message in batch:
+                    key = (message.task, json.dumps(message.args))
+                    if key not in seen:
+                        try:
+                            current_app.tasks[message.task].apply_async(message.args)
+                        except Exception as exc:  # kombu raises its own errors per transport
+                            error = exc
+                            break
+                        seen.add(key)
+                        published += 1
+                    done.append(message.id)
+                self.filter(id__in=done).delete()
+            if error is not None:
+                raise error
+
+
+class OutboxMessage(models.Model):
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxManager()
+
+    class Meta:
+        verbose_name = 'Исходящая задача'
+        verbose_name_plural = 'Исходящие задачи'
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)}'
@@ -0,0 +1,27 @@
+ADMIN_EMAIL = 'admin@example.com'
+
+
+def build_digests(notifications):
+    """
+    Group notifications per (sender, recipient) into (send_mass_mail
+    datatuple, notification ids) pairs.
+
+    Duplicate (subject, message) pairs are dropped; a recipient with several
+    messages gets a single digest instead.
+    """
+    groups = {}
+    for notification in notifications:
+        messages, ids = groups.setdefault((notification.from_email, notification.recipient), ({}, []))
+        messages.setdefault((notification.subject, notification.message), None)
+        ids.append(notification.id)
+
+    digests = []
+    for (from_email, recipient), (messages, ids) in groups.items():
+        messages = list(messages)
+        if len(messages) == 1:
+            subject, message = messages[0]
+        else:
+            subject = f'Дайджест: {len(messages)} уведомлений'
+            message = '\n\n---\n\n'.join(f'{subject}\n{message}' for subject, message in messages)
+        digests.append(((subject, message, from_email, [recipient]), ids))
+    return digests
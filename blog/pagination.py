@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+
+from asgiref.sync import sync_to_async
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class CursorPage:
+    """Page of a CursorPaginator; rows are fetched on first access."""
+
+    def __init__(self, paginator, cursor):
+        self.paginator = paginator
+        self.cursor = cursor
+        self._result = None
+
+    def _fetch(self):
+        if self._result is None:
+            self._result = self.paginator.fetch(self.cursor)
+        return self._result
+
+    @property
+    def object_list(self):
+        return self._fetch()[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} objects>'
+
+    def has_next(self):
+        return self._fetch()[1]
+
+    def has_previous(self):
+        return self._fetch()[2]
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], reverse=False)
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], reverse=True)
+
+
+class CursorPaginator:
+    """
+    Keyset paginator: pages are addressed by an opaque cursor holding the
+    ordering values of the last (or first) row seen instead of an OFFSET,
+    so no COUNT(*) is needed and every page costs the same.
+
+    `ordering` must end with a unique field, e.g. ('-publish', '-id'); it may
+    also name annotations such as a search rank.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    def _field(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name.lstrip('-'))
+        except FieldDoesNotExist:
+            return None
+
+    def _to_python(self, name, value):
+        field = self._field(name)
+        if field is None:
+            # An annotation: coerce to its output field, so a tampered value fails here and not in the query.
+            field = self.queryset.query.annotations[name.lstrip('-')].output_field
+        return field.to_python(value)
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for name in self.ordering:
+            field = self._field(name)
+            # value_to_string keeps full precision, so equality on the tie-breaker holds.
+            values.append(field.value_to_string(obj) if field else getattr(obj, name.lstrip('-')))
+        payload = json.dumps({'r': reverse, 'v': values})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Return (reverse, values) or None for a missing or malformed cursor."""
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = payload['v']
+            if len(values) != len(self.ordering):
+                return None
+            values = [self._to_python(name, value) for name, value in zip(self.ordering, values)]
+            if None in values:
+                return None
+            return bool(payload['r']), values
+        except (binascii.Error, ValueError, TypeError, KeyError, AttributeError, ValidationError):
+            return None
+
+    def _after(self, values, reverse):
+        """Q matching rows strictly after `values` in the (possibly reversed) ordering."""
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            name = self.ordering[index]
+            descending = name.startswith('-') != reverse
+            lookup = f"{name.lstrip('-')}__{'lt' if descending else 'gt'}"
+            equal = {self.ordering[i].lstrip('-'): values[i] for i in range(index)}
+            condition |= Q(**equal, **{lookup: values[index]})
+        # Redundant, but the OR of the expansion alone cannot bound an index range
+        # scan on the ordering columns; this conjunct can.
+        first = self.ordering[0]
+        descending = first.startswith('-') != reverse
+        return Q(**{f"{first.lstrip('-')}__{'lte' if descending else 'gte'}": values[0]}) & condition
+
+    def page(self, cursor=None):
+        return CursorPage(self, cursor)
+
+    async def apage(self, cursor=None):
+        """page() for async views: the rows are fetched before it returns."""
+        page = CursorPage(self, cursor)
+        await sync_to_async(page._fetch)()
+        return page
+
+    def fetch(self, cursor):
+        """Return (rows, has_next, has_previous) of the page at `cursor`."""
+        decoded = self.decode_cursor(cursor)
+        if decoded is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return rows[:self.per_page], len(rows) > self.per_page, False
+
+        reverse, values = decoded
+        ordering = self.ordering
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+        rows = list(self.queryset.filter(self._after(values, reverse)).order_by(*ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return rows, True, more
+        return rows, more, True
@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DB-API connections for one database in one
+    process. At most `size` connections are checked out; further checkouts
+    wait up to `timeout` seconds. An idle connection is health-checked before
+    reuse when it was returned more than `check_after` seconds ago, and
+    closed once idle for `max_idle` seconds.
+    """
+    counters = ('checkouts', 'waits', 'timeouts', 'opened', 'closed', 'failed_checks')
+
+    def __init__(self, size, timeout=10.0, check_after=0.0, max_idle=300.0):
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._free = size
+        # Waiting checkouts, served first come first served: a released slot is handed
+        # to the oldest waiter, so new arrivals cannot starve requests already waiting.
+        self._waiters = deque()
+        self._idle = deque()  # (connection, returned at), most recently returned last
+        self._stats = dict.fromkeys(self.counters, 0)
+        self._open = self._max_open = self._in_use = 0
+        self._wait_time = self._max_wait = 0.0
+
+    def acquire(self, connect, check):
+        """Check out an idle connection that passes `check(connection)`, or one from `connect()`."""
+        start = time.perf_counter()
+        self._take_slot()
+        waited = time.perf_counter() - start
+        try:
+            connection = self._reuse(check) or self._new(connect)
+        except BaseException:
+            self._give_slot()
+            raise
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return connection
+
+    def release(self, connection, reset, discard=False):
+        """Return a connection; it is closed instead when `discard` is set or `reset(connection)` fails."""
+        if not discard:
+            try:
+                reset(connection)
+            except Exception:
+                discard = True
+        with self._lock:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append((connection, time.monotonic()))
+        if discard:
+            self._close(connection)
+        self._give_slot()
+        self.close_idle(self.max_idle)
+
+    def close_idle(self, older_than=0.0):
+        """Close connections idle for more than `older_than` seconds."""
+        limit = time.monotonic() - older_than
+        while True:
+            with self._lock:
+                if not self._idle or self._idle[0][1] > limit:
+                    return
+                connection, _ = self._idle.popleft()
+            self._close(connection)
+
+    def snapshot(self):
+        """Gauges and counters since start; wait times in milliseconds."""
+        with self._lock:
+            checkouts = self._stats['checkouts']
+            return {
+                'size': self.size,
+                'open': self._open,
+                'max_open': self._max_open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **self._stats,
+                'avg_wait_ms': round(self._wait_time * 1000 / checkouts, 3) if checkouts else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 3),
+            }
+
+    def _take_slot(self):
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            self._stats['waits'] += 1
+            turn = threading.Event()
+            self._waiters.append(turn)
+        if turn.wait(self.timeout):
+            return
+        with self._lock:
+            # The slot may have been handed over just after the wait timed out.
+            if turn.is_set():
+                return
+            self._waiters.remove(turn)
+            self._stats['timeouts'] += 1
+        raise PoolTimeout(f'No database connection free within {self.timeout}s ({self.size} in use)')
+
+    def _give_slot(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._free += 1
+
+    def _reuse(self, check):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, returned_at = self._idle.pop()
+            if time.monotonic() - returned_at <= self.check_after:
+                return connection
+            try:
+                check(connection)
+                return connection
+            except Exception:
+                # Killed by a database restart, a failover or an idle timeout on the server.
+                self._count('failed_checks')
+                self._close(connection)
+
+    def _new(self, connect):
+        connection = connect()
+        with self._lock:
+            self._stats['opened'] += 1
+            self._open += 1
+            self._max_open = max(self._max_open, self._open)
+        return connection
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['closed'] += 1
+            self._open -= 1
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+
+# One pool per database alias and process: forked workers must not share sockets.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options):
+    key = (os.getpid(), alias)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(options.get('SIZE', 10), options.get('TIMEOUT', 10.0),
+                                         options.get('CHECK_AFTER', 0.0), options.get('MAX_IDLE', 300.0))
+        return _pools[key]
+
+
+def pool_stats():
+    """{alias: snapshot} of the pools of this process."""
+    pid = os.getpid()
+    return {alias: pool.snapshot() for (owner, alias), pool in list(_pools.items()) if owner == pid}
+
+
+def _ping(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    finally:
+        cursor.close()
+
+
+def _rollback(connection):
+    # Normally a no-op: Django returns connections in autocommit mode.
+    connection.rollback()
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Take connections from the process-wide ConnectionPool of the alias
+    instead of opening them, and return them on close(). Configured by
+    DATABASES[alias]['POOL'] (SIZE, TIMEOUT, CHECK_AFTER, MAX_IDLE); use
+    CONN_MAX_AGE = 0 so every request gives its connection back when it ends.
+    """
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        def connect():
+            return super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+        try:
+            return self.pool.acquire(connect, _ping)
+        except PoolTimeout as error:
+            raise self.Database.OperationalError(str(error)) from error
+
+    def _close(self):
+        if self.connection is not None:
+            # Closed inside an atomic block the connection stays attached to this
+            # wrapper until the block exits, so it cannot be handed to anyone else.
+            self.pool.release(self.connection, _rollback, discard=self.in_atomic_block)
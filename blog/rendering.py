@@ -0,0 +1,20 @@
+import threading
+
+import markdown
+
+
+# Bump MARKDOWN_RENDERER_VERSION whenever MARKDOWN_EXTENSIONS or their options
+# change, then run `./manage.py rerender_markdown` to refresh stored HTML.
+MARKDOWN_EXTENSIONS = ['markdown.extensions.fenced_code']
+MARKDOWN_RENDERER_VERSION = 1
+
+# Building a Markdown instance loads every extension and pattern, which costs
+# about as much as rendering a post; keep one per thread (they are not thread-safe).
+_local = threading.local()
+
+
+def render_markdown(value):
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None:
+        renderer = _local.renderer = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return renderer.reset().convert(value)
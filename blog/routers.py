@@ -0,0 +1,47 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# Set for the duration of requests that write, or that read rows the visitor
+# may have just written and a lagging replica would not have yet.
+_pinned = contextvars.ContextVar('pinned_to_primary', default=False)
+
+# Set by PrimaryPinningMiddleware after a write, for BLOG_PRIMARY_PIN_SECONDS.
+PIN_COOKIE = 'primary_db'
+
+# Session rows are written on login and read again on the very next request.
+PRIMARY_ONLY_APPS = ('sessions',)
+
+
+@contextmanager
+def use_primary():
+    """Send the reads inside the block (and its sync_to_async calls) to the primary database."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Reads go to a random database of BLOG_READ_REPLICAS, writes and pinned
+    reads to 'default'. Querysets marked for write (select_for_update(),
+    update(), get_or_create() ...) use db_for_write, so locks stay on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.BLOG_READ_REPLICAS
+        if not replicas or _pinned.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same rows.
+        return True
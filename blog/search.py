@@ -0,0 +1,87 @@
+"""
+Full-text search over published posts.
+
+PostgreSQL keeps a `blog_post.search_vector` column up to date with a
+trigger (weights: title A, short description B, body C; Russian stemming)
+behind a GIN index. The column is deliberately not a model field, so feed
+queries never fetch it. SQLite, used for tests and local runs without
+Postgres, has no tsvector: posts are mirrored into the `blog_post_fts` FTS5
+table by Post.save/delete instead. See migration 0013.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+
+SEARCH_CONFIG = 'russian'
+
+_words = re.compile(r'\w+')
+
+
+def _fts5_query(query):
+    # Quote every word: FTS5 treats punctuation and bare keywords as syntax.
+    return ' '.join(f'"{word}"' for word in _words.findall(query))
+
+
+def search_posts(queryset, query):
+    """Filter `queryset` to posts matching `query`, annotated with `rank` (higher is better)."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.alias(
+            search_vector=RawSQL('blog_post.search_vector', [], output_field=SearchVectorField()),
+        ).filter(search_vector=search_query).annotate(
+            # ts_rank() returns real: cast, so ordering and the cursor's `rank <` comparison
+            # against the float decoded from the cursor both use double precision.
+            rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()),
+        )
+    match = _fts5_query(query)
+    if not match:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+    return queryset.filter(
+        id__in=RawSQL('SELECT rowid FROM blog_post_fts WHERE blog_post_fts MATCH %s', [match]),
+    ).annotate(
+        # Column weights mirror the Postgres A/B/C weights of title, description and body.
+        rank=RawSQL('SELECT -bm25(blog_post_fts, 10.0, 4.0, 1.0) FROM blog_post_fts '
+                    'WHERE blog_post_fts MATCH %s AND rowid = blog_post.id', [match]),
+    )
+
+
+def index_post(post):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM blog_post_fts WHERE rowid = %s', [post.pk])
+        cursor.execute('INSERT INTO blog_post_fts (rowid, title, short_description, body) VALUES (%s, %s, %s, %s)',
+                       [post.pk, post.title, post.short_description, post.body])
+
+
+def index_posts(posts):
+    """index_post() of freshly inserted posts, with one statement for the batch."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany('INSERT INTO blog_post_fts (rowid, title, short_description, body) VALUES (%s, %s, %s, %s)',
+                           [[post.pk, post.title, post.short_description, post.body] for post in posts])
+
+
+def unindex_post(pk):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM blog_post_fts WHERE rowid = %s', [pk])
+
+
+def rebuild_index():
+    """Recompute the search data of every post, e.g. after bulk imports."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Touching the columns fires the trigger that recomputes the vector.
+            cursor.execute('UPDATE blog_post SET title = title')
+        else:
+            cursor.execute('DELETE FROM blog_post_fts')
+            cursor.execute('INSERT INTO blog_post_fts (rowid, title, short_description, body) '
+                           'SELECT id, title, short_description, body FROM blog_post')
@@ -0,0 +1,144 @@
+import gzip
+import json
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Sum
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.xmlutils import SimplerXMLGenerator
+
+
+# Chunk files, the index and the manifest of chunk fingerprints live in the
+# default storage (S3 in production) and are served by views.sitemap_file.
+SITEMAP_DIR = 'sitemaps'
+SITEMAP_INDEX = f'{SITEMAP_DIR}/sitemap.xml'
+SITEMAP_MANIFEST = f'{SITEMAP_DIR}/manifest.json'
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+KEYSET_BATCH_SIZE = 2000
+
+
+def _absolute(path):
+    return f'{settings.SCHEMA}://{settings.DOMAIN}{path}'
+
+
+def _post_urls(row):
+    _, slug, updated = row
+    return _absolute(reverse('blog:post_detail', args=[slug])), updated
+
+
+def _author_urls(row):
+    return _absolute(reverse('blog:author_profile', args=[row[0]])), None
+
+
+def _sections():
+    """(section, queryset, fields, fingerprint aggregates, row -> (loc, lastmod)) of every sitemap section."""
+    post_model, author_model = apps.get_model('blog', 'Post'), apps.get_model('blog', 'Author')
+    return (
+        ('posts', post_model.published.all(), ('pk', 'slug', 'updated'), {'lastmod': Max('updated')}, _post_urls),
+        ('authors', author_model.objects.filter(published_posts__gt=0), ('pk',), {}, _author_urls),
+    )
+
+
+def chunk_fingerprints(queryset, chunk_size, **aggregates):
+    """
+    {chunk number: fingerprint} with one GROUP BY query. Chunk n holds the
+    primary keys n * chunk_size + 1 ... (n + 1) * chunk_size, so new rows only
+    ever change the last chunk. Row count and key sum change when rows
+    enter or leave a chunk, the aggregates (e.g. Max('updated')) on edits.
+    """
+    chunk = ExpressionWrapper((F('pk') - 1) / chunk_size, output_field=IntegerField())
+    rows = (queryset.order_by().annotate(chunk=chunk).values('chunk')
+            .annotate(rows=Count('pk'), keys=Sum('pk'), **aggregates))
+    return {row.pop('chunk'): ':'.join(str(value) for _, value in sorted(row.items())) for row in rows}
+
+
+def keyset_rows(queryset, fields, start, stop, batch_size=KEYSET_BATCH_SIZE):
+    """Yield `fields` of the rows with start < pk <= stop, one primary-key range query per batch."""
+    last_pk = start
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk, pk__lte=stop).order_by('pk').values_list(*fields)[:batch_size])
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_pk = rows[-1][0]
+
+
+def write_urlset(urls):
+    """Gzipped <urlset> of (loc, lastmod) pairs, written as they come."""
+    buffer = BytesIO()
+    # mtime=0 keeps regenerated but unchanged chunks byte-identical.
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed:
+        handler = SimplerXMLGenerator(compressed, 'utf-8', short_empty_elements=True)
+        handler.startDocument()
+        handler.startElement('urlset', {'xmlns': SITEMAP_NAMESPACE})
+        for loc, lastmod in urls:
+            handler.startElement('url', {})
+            handler.addQuickElement('loc', loc)
+            if lastmod is not None:
+                handler.addQuickElement('lastmod', lastmod.isoformat(timespec='seconds'))
+            handler.endElement('url')
+        handler.endElement('urlset')
+    return buffer.getvalue()
+
+
+def write_index(entries):
+    buffer = BytesIO()
+    handler = SimplerXMLGenerator(buffer, 'utf-8', short_empty_elements=True)
+    handler.startDocument()
+    handler.startElement('sitemapindex', {'xmlns': SITEMAP_NAMESPACE})
+    for entry in entries:
+        handler.startElement('sitemap', {})
+        handler.addQuickElement('loc', _absolute(reverse('sitemap_file', args=[os.path.basename(entry['name'])])))
+        handler.addQuickElement('lastmod', entry['lastmod'])
+        handler.endElement('sitemap')
+    handler.endElement('sitemapindex')
+    return buffer.getvalue()
+
+
+def _replace(name, content):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, ContentFile(content))
+
+
+def _load_manifest():
+    if not default_storage.exists(SITEMAP_MANIFEST):
+        return {}
+    with default_storage.open(SITEMAP_MANIFEST) as manifest:
+        return json.load(manifest)
+
+
+def generate_sitemaps(force=False):
+    """
+    Bring the sitemap index and its chunk files up to date and return the
+    keys of the chunks written. Only chunks whose fingerprint changed since
+    the last run are rebuilt; chunks left without rows are deleted.
+    """
+    chunk_size = settings.BLOG_SITEMAP_CHUNK_SIZE
+    manifest = _load_manifest()
+    previous = manifest.get('chunks', {})
+    # Chunk numbers mean other key ranges after a chunk size change.
+    chunks = {} if force or manifest.get('chunk_size') != chunk_size else previous
+    written, current = [], {}
+    for section, queryset, fields, aggregates, to_url in _sections():
+        for number, fingerprint in sorted(chunk_fingerprints(queryset, chunk_size, **aggregates).items()):
+            key = f'{section}-{number + 1}'
+            current[key] = entry = chunks.get(key)
+            if entry and entry['fingerprint'] == fingerprint:
+                continue
+            rows = keyset_rows(queryset, fields, number * chunk_size, (number + 1) * chunk_size)
+            name = _replace(f'{SITEMAP_DIR}/{key}.xml.gz', write_urlset(map(to_url, rows)))
+            current[key] = {'name': name, 'fingerprint': fingerprint,
+                            'lastmod': timezone.now().isoformat(timespec='seconds')}
+            written.append(key)
+    for key in previous.keys() - current.keys():
+        default_storage.delete(previous[key]['name'])
+    if written or previous.keys() != current.keys() or not default_storage.exists(SITEMAP_INDEX):
+        _replace(SITEMAP_INDEX, write_index(current.values()))
+        _replace(SITEMAP_MANIFEST, json.dumps({'chunk_size': chunk_size, 'chunks': current}).encode())
+    return written
@@ -0,0 +1,72 @@
+import re
+
+from django.db import transaction
+from django.db.models import Count, Min
+
+
+def unique_slug(queryset, base, max_length):
+    """Return `base`, or `base-N` with the smallest free N, not used by `queryset`."""
+    base = base[:max_length]
+    return _first_free(base, _taken_like(queryset, base, max_length), max_length)
+
+
+def unique_slugs(queryset, bases, max_length):
+    """
+    unique_slug() of every base in `bases`, also unique among each other:
+    one query for the whole list, plus one per base that is already taken.
+    """
+    bases = [base[:max_length] for base in bases]
+    taken = set(queryset.filter(slug__in=set(bases)).values_list('slug', flat=True))
+    looked_up = set()
+    slugs = []
+    for base in bases:
+        if base in taken and base not in looked_up:
+            taken |= _taken_like(queryset, base, max_length)
+            looked_up.add(base)
+        slug = _first_free(base, taken, max_length)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def _taken_like(queryset, base, max_length):
+    """The slugs of `queryset` that _first_free() could pick for `base`: itself and its -N variants."""
+    # A variant cuts the base to make room for its tail, of up to seven digits.
+    stems = {}
+    for digits in range(1, 8):
+        stems.setdefault(base[:max_length - digits - 1], []).append(digits)
+    variants = [f'{re.escape(stem)}-[0-9]{{{min(digits)},{max(digits)}}}' for stem, digits in stems.items()]
+    pattern = f'^({re.escape(base)}|{"|".join(variants)})$'
+    # The prefix lets Postgres range-scan the slug's varchar_pattern_ops index; the regex can't.
+    return set(queryset.filter(slug__startswith=base[:max_length - 8], slug__regex=pattern)
+               .values_list('slug', flat=True))
+
+
+def _first_free(base, taken, max_length):
+    slug = base
+    suffix = 1
+    while slug in taken:
+        suffix += 1
+        tail = f'-{suffix}'
+        slug = f'{base[:max_length - len(tail)]}{tail}'
+    return slug
+
+
+def dedupe_slugs(model, batch_size=100):
+    """Re-slug rows sharing a slug with an older row, committing every `batch_size` slugs."""
+    duplicates = list(model.objects.values('slug')
+                      .annotate(rows=Count('id'), keep=Min('id'))
+                      .filter(rows__gt=1)
+                      .order_by('slug'))
+    max_length = model._meta.get_field('slug').max_length
+    fixed = 0
+    for start in range(0, len(duplicates), batch_size):
+        with transaction.atomic():
+            for row in duplicates[start:start + batch_size]:
+                ids = (model.objects.filter(slug=row['slug']).exclude(id=row['keep'])
+                       .order_by('id').values_list('id', flat=True))
+                for pk in list(ids):
+                    slug = unique_slug(model.objects.all(), row['slug'], max_length)
+                    model.objects.filter(id=pk).update(slug=slug)
+                    fixed += 1
+    return fixed
@@ -0,0 +1,73 @@
+from fnmatch import fnmatch
+from io import BytesIO
+
+from PIL import Image
+
+from django.core.files.base import ContentFile
+
+import rcssmin
+
+import rjsmin
+
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+# Collected files rewritten in STATIC_ROOT before they are hashed, by glob.
+MINIFIERS = {
+    'vendor/css/*.css': rcssmin.cssmin,
+    'vendor/js/*.js': rjsmin.jsmin,
+}
+RECOMPRESSED_JPEGS = ('vendor/assets/img/*-bg.jpg',)
+JPEG_QUALITY = 80
+# A recompressed JPEG only replaces the file when it is this much smaller,
+# so running collectstatic again does not degrade it further.
+JPEG_MIN_SAVING = 0.1
+
+
+def recompress_jpeg(data):
+    image = Image.open(BytesIO(data))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    if buffer.tell() <= len(data) * (1 - JPEG_MIN_SAVING):
+        return buffer.getvalue()
+    return data
+
+
+def optimizer(name):
+    """Return a bytes -> bytes function optimizing the static file `name`, or None."""
+    if any(fnmatch(name, pattern) for pattern in RECOMPRESSED_JPEGS):
+        return recompress_jpeg
+    for pattern, minifier in MINIFIERS.items():
+        if fnmatch(name, pattern):
+            return lambda data: minifier(data.decode()).encode()
+    return None
+
+
+class OptimizedManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    collectstatic storage: minifies the vendor CSS and JS and recompresses
+    the background JPEGs, then stores content-hashed copies (which
+    WhiteNoise serves with an immutable Cache-Control) and their gzip and
+    Brotli versions.
+    """
+
+    def optimize(self, name, transform):
+        with self.open(name) as collected:
+            original = collected.read()
+        optimized = transform(original)
+        if optimized != original:
+            self.delete(name)
+            self._save(name, ContentFile(optimized))
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            for name in paths:
+                transform = optimizer(name)
+                if transform:
+                    # The collected copy is optimized once (both transforms are idempotent) and
+                    # hashed and compressed instead of the source file, also on later runs that
+                    # skip copying an unchanged file.
+                    self.optimize(name, transform)
+                    paths[name] = (self, name)
+        yield from super(OptimizedManifestStaticFilesStorage, self).post_process(paths, dry_run=dry_run, **options)
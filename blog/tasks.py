@@ -1,47 +1,116 @@
+from smtplib import SMTPException
+
 from celery import shared_task
 
-from django.core.mail import send_mail
+from django.apps import apps
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import bump_versions
+from .edge import get_purge_backend
+from .images import delete_variants, generate_variants, variants_field, variants_stale
+from .notifications import ADMIN_EMAIL
+from .sitemaps import generate_sitemaps
+
+
+def _notifications():
+    return apps.get_model('blog', 'Notification').objects
+
+
+def _outbox():
+    return apps.get_model('blog', 'OutboxMessage').objects
+
+
+# A batch is deleted only after it was sent, so a retry picks up from the batch
+# that failed. Backoff 10s, 20s, 40s ... (jittered), at most 10 minutes.
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=10, retry_backoff_max=10 * 60,
+             max_retries=8, rate_limit='6/m')
+def flush_notifications():
+    return _notifications().flush()
+
+
+@shared_task(rate_limit='30/m', acks_late=True)
+def generate_image_variants(model_label, pk, field_name):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not variants_stale(instance, field_name):
+        return
+    image = getattr(instance, field_name)
+    previous = getattr(instance, variants_field(field_name))
+    description = generate_variants(image) if image else {}
+    changes = {variants_field(field_name): description}
+    if model_label == 'blog.Post':
+        changes['updated'] = timezone.now()
+        scopes = ('feed', f'post:{pk}', f'author:{instance.author_id}', f'slug:{instance.slug}')
+    else:
+        scopes = (f'author:{pk}',)
+    # Only store the result if the image was not replaced meanwhile, and drop
+    # the files nothing refers to any more: the old upload's or these ones.
+    stored = model.objects.filter(pk=pk, **{field_name: image.name or ''}).update(**changes)
+    if stored:
+        delete_variants(image.storage, previous, keep=description)
+        bump_versions(*scopes)
+    else:
+        delete_variants(image.storage, description, keep=previous)
+    cache.delete(_variants_lock(model_label, pk, field_name))
+    if not stored:
+        # The save that replaced the image found the lock taken: queue the new image here.
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            schedule_image_variants(instance, field_name)
+
+
+def _variants_lock(model_label, pk, field_name):
+    return f'blog:image-variants:{model_label}:{pk}:{field_name}'
+
+
+def schedule_image_variants(instance, field_name):
+    """
+    Queue derivative generation through the outbox, at most once per 10
+    minutes. Called on save(); images saved before the pipeline existed are
+    backfilled by the generate_image_variants command.
+    """
+    if not variants_stale(instance, field_name):
+        return
+    model_label = instance._meta.label
+    if cache.add(_variants_lock(model_label, instance.pk, field_name), True, 60 * 10):
+        _outbox().add('blog.tasks.generate_image_variants', model_label, instance.pk, field_name)
+
+
+@shared_task(acks_late=True)
+def regenerate_sitemaps():
+    # Skip the run if the previous one is still writing chunks.
+    if not cache.add('blog:sitemaps', True, 60 * 30):
+        return []
+    try:
+        return generate_sitemaps()
+    finally:
+        cache.delete('blog:sitemaps')
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=5, max_retries=5, rate_limit='60/m')
+def purge_surrogate_keys(keys):
+    get_purge_backend().purge(keys)
+
 
+# The tasks below only queue the e-mail for the next flush. Callers queue
+# notifications directly; these remain for messages already on the broker.
 
 @shared_task
 def new_comment(subject, message):
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email='admin@example.com',
-        recipient_list=['admin@example.com'],
-        fail_silently=False
-    )
+    _notifications().enqueue(subject, message, [ADMIN_EMAIL])
 
 
 @shared_task
 def new_post(subject, message):
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email='admin@example.com',
-        recipient_list=['admin@example.com'],
-        fail_silently=False
-    )
+    _notifications().enqueue(subject, message, [ADMIN_EMAIL])
 
 
 @shared_task
 def comment_active(subject, author, message):
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email='admin@example.com',
-        recipient_list=['admin@example.com', author],
-        fail_silently=False
-    )
+    _notifications().enqueue(subject, message, [ADMIN_EMAIL, author])
 
 
 @shared_task
 def send_contact(subject, email, message):
-    send_mail(
-        subject=subject,
-        message=message,
-        from_email=email,
-        recipient_list=['admin@example.com'],
-        fail_silently=False
-    )
+    _notifications().enqueue(subject, message, [ADMIN_EMAIL], from_email=email)
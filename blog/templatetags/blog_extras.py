@@ -1,7 +1,9 @@
 from django import template
 from django.template.defaultfilters import stringfilter
+from django.utils.html import format_html
 
-import markdown
+from ..images import VARIANT_FORMATS, srcsets, variants_field
+from ..rendering import render_markdown
 
 
 register = template.Library()
@@ -10,4 +12,27 @@ register = template.Library()
 @register.filter
 @stringfilter
 def convert_markdown(value):
-    return markdown.markdown(value, extensions=['markdown.extensions.fenced_code'])
+    return render_markdown(value)
+
+
+@register.simple_tag
+def responsive_image(instance, field_name, alt='', sizes='(min-width: 1200px) 636px, 100vw'):
+    """
+    <picture> with WebP and JPEG srcsets of the derivatives of an image field.
+
+    Falls back to the original file while the derivatives are missing or
+    were built for a previous upload. Rendering never queues them: save()
+    does (see schedule_image_variants).
+    """
+    image = getattr(instance, field_name)
+    if not image:
+        return ''
+    candidates = srcsets(image, getattr(instance, variants_field(field_name)))
+    if not candidates:
+        return format_html('<img src="{}" class="img-fluid" alt="{}">', image.url, alt)
+    return format_html(
+        '<picture><source type="{}" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="img-fluid" alt="{}" loading="lazy"></picture>',
+        VARIANT_FORMATS['webp'][1], candidates['webp'], sizes,
+        image.url, candidates['jpeg'], sizes, alt,
+    )
@@ -0,0 +1,19 @@
+from django.template.backends import django as django_backend
+
+from .middleware import timed_render
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        return timed_render(super(Template, self).render, context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock Django template backend, with render times counted by PerformanceMiddleware."""
+
+    def from_string(self, template_code):
+        return Template(super(DjangoTemplates, self).from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super(DjangoTemplates, self).get_template(template_name).template, self)
@@ -2,23 +2,29 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path
 
-from .views import AuthorProfile, PostCreateView, PostDelete, PostDetailView, PostUpdate, PostsView, \
-    about_page, contact_form, post_by_auth, post_comment
+from .views import PostCreateView, PostDelete, PostUpdate, about_page, author_feed, author_profile, contact_form, \
+    db_pool_stats, feed, performance_stats, post_by_auth, post_comment, post_detail, posts, search, visitor
 
 
 app_name = 'blog'
 
 urlpatterns = [
-    path('', PostsView.as_view(), name='posts'),
+    path('', posts, name='posts'),
     path('contact/', contact_form, name='contact'),
     path('about/', about_page, name='about'),
-    path('<slug>/', PostDetailView.as_view(), name='post_detail'),
+    path('search/', search, name='search'),
+    path('feed/<str:feed_format>/', feed, name='feed'),
+    path('visitor/', visitor, name='visitor'),
+    path('<slug>/', post_detail, name='post_detail'),
     path('posts/add/', PostCreateView.as_view(), name='post_create'),
     path('posts/<int:pk>/update/', PostUpdate.as_view(), name='post_update'),
     path('posts/<int:pk>/delete/', PostDelete.as_view(), name='post_delete'),
     path('posts/<int:pk>', post_by_auth, name='post_by_auth'),
     path('<int:post_id>/comment/', post_comment, name='post_comment'),
-    path('author/<int:pk>/', AuthorProfile.as_view(), name='author_profile'),
+    path('author/<int:pk>/', author_profile, name='author_profile'),
+    path('author/<int:pk>/feed/<str:feed_format>/', author_feed, name='author_feed'),
+    path('stats/performance/', performance_stats, name='performance_stats'),
+    path('stats/db-pool/', db_pool_stats, name='db_pool_stats'),
 
 ]
 
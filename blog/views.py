@@ -1,73 +1,167 @@
+from contextlib import nullcontext
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, views
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.http import Http404
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, render
 from django.template.loader import render_to_string
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views import generic
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import require_POST, require_safe
 
+from .cache import aget_versions, cache_anonymous_page, conditional_page, has_session
+from .edge import add_surrogate_keys
+from .feeds import feed_response
 from .forms import AuthorCreationForm, CommentForm, ContactForm
-from .models import Author, Post
-from .tasks import new_comment, send_contact
-
-
-class PostsView(generic.ListView):
-    template_name = 'blog/posts.html'
-    context_object_name = 'posts'
-    paginate_by = 5
-    queryset = Post.published.select_related('author')
-
-
-def post_by_auth(request, pk):
-    author = get_object_or_404(Author, id=pk)
-    if request.user == author:
-        objects_list = Post.objects.filter(author=author)
+from .middleware import registry
+from .models import Author, Notification, Post
+from .notifications import ADMIN_EMAIL
+from .pagination import CursorPaginator
+from .pool import pool_stats
+from .routers import use_primary
+from .search import search_posts
+from .sitemaps import SITEMAP_DIR, SITEMAP_INDEX
+
+
+# The public read views are async: under ASGI a slow query or storage call
+# waits in a worker thread instead of holding the whole server worker.
+# Django 4.0 has no async ORM, so queries and template rendering (which may
+# touch request.user or the image storage) run through sync_to_async.
+arender = sync_to_async(render)
+aget_object_or_404 = sync_to_async(get_object_or_404)
+
+
+async def aget_user(request):
+    """Load the lazy request.user off the event loop; without a session it is anonymous and loads nothing."""
+    if not has_session(request):
+        # Not request.user: evaluating it marks the session accessed, which adds Vary: Cookie.
+        return AnonymousUser()
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+def async_require_safe(view_func):
+    """require_safe for async views; Django 4.0's decorator only wraps sync ones."""
+    @wraps(view_func)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view_func(request, *args, **kwargs)
+    return inner
+
+
+POSTS_PER_PAGE = 5
+
+
+def _post_keys(posts):
+    """Surrogate keys of the posts and authors shown in a listing."""
+    return [key for post in posts for key in (f'post:{post.pk}', f'author:{post.author_id}')]
+
+
+def posts_validators(request):
+    # Ids, edit times and author names of the rows of the requested page: one query on the feed index.
+    queryset = Post.published.select_related('author').only('id', 'publish', 'updated', 'author__username')
+    page = CursorPaginator(queryset, POSTS_PER_PAGE, ordering=('-publish', '-id')).page(request.GET.get('cursor'))
+    rows = [(post.id, post.updated, post.author.username) for post in page]
+    return (rows, page.has_next(), page.has_previous()), max((updated for _, updated, _ in rows), default=None)
+
+
+@async_require_safe
+@cache_anonymous_page('feed', params=('cursor',))
+@conditional_page(posts_validators)
+async def posts(request):
+    paginator = CursorPaginator(Post.published.select_related('author'), POSTS_PER_PAGE, ordering=('-publish', '-id'))
+    page_obj = await paginator.apage(request.GET.get('cursor'))
+    response = await arender(request, 'blog/posts.html', {
+        'posts': page_obj.object_list,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+    })
+    return add_surrogate_keys(response, 'feed', *_post_keys(page_obj))
+
+
+@async_require_safe
+@cache_anonymous_page('author:{pk}', params=('cursor',))
+async def post_by_auth(request, pk):
+    author = await aget_object_or_404(Author, id=pk)
+    own_posts = await aget_user(request) == author
+    if own_posts:
+        objects_list = Post.objects.filter(author=author).select_related('author')
     else:
-        objects_list = Post.published.filter(author=author)
-    page_num = request.GET.get('page', 1)
-    paginator = Paginator(objects_list, 3)
-    try:
-        page_obj = paginator.page(page_num)
-    except PageNotAnInteger:
-        page_obj = paginator.page(1)
-    except EmptyPage:
-        page_obj = paginator.page(paginator.num_pages)
-
-    return render(request, 'blog/post_by_auth.html', {'page_obj': page_obj, 'author': author})
-
-
-class PostDetailView(generic.DetailView):
-    model = Post
-    template_name = 'blog/post_detail.html'
-
-    def get_context_data(self, **kwargs):
-        context = super(PostDetailView, self).get_context_data(**kwargs)
-        objects_list = self.object.comments.filter(active=True)
-        page_num = self.request.GET.get('page', 1)
-        paginator = Paginator(objects_list, 3)
-        total_comments = objects_list.count()
-        try:
-            page_obj = paginator.page(page_num)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-
-        context['page_obj'] = page_obj
-        if self.request.user.is_authenticated:
-            context['form'] = CommentForm(
-                initial={'email': self.request.user.email, 'name': self.request.user.username}
-            )
-        else:
-            context['form'] = CommentForm()
-        context['total_comments'] = total_comments
-        return context
+        objects_list = Post.published.filter(author=author).select_related('author')
+    paginator = CursorPaginator(objects_list, 3, ordering=('-publish', '-id'))
+    # The author's own drafts and edits are read back from the primary.
+    with use_primary() if own_posts else nullcontext():
+        page_obj = await paginator.apage(request.GET.get('cursor'))
+
+    response = await arender(request, 'blog/post_by_auth.html', {'page_obj': page_obj, 'author': author})
+    return add_surrogate_keys(response, f'author:{pk}', *_post_keys(page_obj))
+
+
+@require_safe
+def feed(request, feed_format):
+    return feed_response(request, Post.published.all(), feed_format,
+                         lambda: ('Bloggie', reverse('blog:posts'), 'Новые посты блога'))
+
+
+@require_safe
+def author_feed(request, pk, feed_format):
+    def describe():
+        author = get_object_or_404(Author, pk=pk)
+        return f'Bloggie: {author.username}', reverse('blog:post_by_auth', args=[pk]), f'Новые посты {author.username}'
+    return feed_response(request, Post.published.filter(author_id=pk), feed_format, describe)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()[:200]
+    page_obj = None
+    if query:
+        results = search_posts(Post.published.select_related('author'), query)
+        page_obj = CursorPaginator(results, 5, ordering=('-rank', '-id')).page(request.GET.get('cursor'))
+    return render(request, 'blog/search.html', {'page_obj': page_obj, 'query': query})
+
+
+def post_detail_validators(request, slug):
+    """The post's edit times, approved comment count and author name, in one query."""
+    rows = list(Post.objects.filter(slug=slug).values_list('id', 'updated', 'approved_comments', 'comments_updated',
+                                                           'author__username')[:1])
+    if not rows:
+        return None
+    _, updated, _, comments_updated, _ = rows[0]
+    # Both only move forward, unlike the newest approved comment, which a deletion takes back.
+    return rows[0], max(updated, comments_updated or updated)
+
+
+@async_require_safe
+@cache_anonymous_page('slug:{slug}', params=('cursor',))
+@conditional_page(post_detail_validators)
+async def post_detail(request, slug):
+    post = await aget_object_or_404(Post, slug=slug)
+    objects_list = post.comments.filter(active=True)
+    paginator = CursorPaginator(objects_list, 3, ordering=('created', 'id'))
+    page_obj = await paginator.apage(request.GET.get('cursor'))
+    response = await arender(request, 'blog/post_detail.html', {
+        'object': post,
+        'post': post,
+        'page_obj': page_obj,
+        'form': CommentForm(),
+        'total_comments': post.approved_comments,
+        'cache_version': await aget_versions(f'post:{post.pk}', f'author:{post.author_id}'),
+    })
+    return add_surrogate_keys(response, f'post:{post.pk}', f'author:{post.author_id}')
 
 
 @require_POST
@@ -78,9 +172,11 @@ def post_comment(request, post_id):
     if form.is_valid():
         comment = form.save(commit=False)
         comment.post = post
-        comment.save()
-        message = f'Новый комментарий к посту: {post.title} автора {post.author}- {comment.body}'
-        new_comment.delay("New comment", message)
+        # No comment without its notification, and the other way round.
+        with transaction.atomic(savepoint=False):
+            comment.save()
+            message = f'Новый комментарий к посту: {post.title} автора {post.author}- {comment.body}'
+            Notification.objects.enqueue("New comment", message, [ADMIN_EMAIL])
 
     return render(request, 'blog/comment.html',
                   {'post': post,
@@ -101,7 +197,15 @@ class PostCreateView(LoginRequiredMixin, generic.CreateView):
         return reverse_lazy('blog:posts')
 
 
-class PostUpdate(LoginRequiredMixin, generic.UpdateView):
+class PrimaryDatabaseMixin:
+    """Load the object from the primary: a form built from a lagging replica would save stale values back."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with use_primary():
+            return super(PrimaryDatabaseMixin, self).dispatch(request, *args, **kwargs)
+
+
+class PostUpdate(LoginRequiredMixin, PrimaryDatabaseMixin, generic.UpdateView):
     model = Post
     fields = ['title', 'short_description', 'body', 'status', 'post_image']
     template_name_suffix = '_update'
@@ -113,7 +217,7 @@ class PostUpdate(LoginRequiredMixin, generic.UpdateView):
         return obj
 
 
-class PostDelete(LoginRequiredMixin, generic.DeleteView):
+class PostDelete(LoginRequiredMixin, PrimaryDatabaseMixin, generic.DeleteView):
     model = Post
     success_url = reverse_lazy('blog:posts')
     template_name_suffix = '_delete'
@@ -143,26 +247,45 @@ class SignUpView(generic.CreateView):
         return super(SignUpView, self).form_valid(form)
 
 
-class UserProfile(LoginRequiredMixin, generic.DetailView):
+class UserProfile(LoginRequiredMixin, PrimaryDatabaseMixin, generic.DetailView):
     model = Author
     template_name = "registration/profile.html"
 
     def get_object(self, queryset=None):
-        user = self.request.user
-        return user
-
-
-class AuthorProfile(generic.DetailView):
-    model = Author
-    template_name = 'blog/author_profile.html'
-
-    def get_context_data(self, **kwargs):
-        context = super(AuthorProfile, self).get_context_data(**kwargs)
-        context['total_posts'] = self.object.author.all().count()
-        return context
+        # request.user only has the REQUEST_USER_FIELDS: load the whole profile in one query.
+        return Author.objects.get(pk=self.request.user.pk)
+
+
+@async_require_safe
+@cache_anonymous_page('author:{pk}')
+async def author_profile(request, pk):
+    author = await aget_object_or_404(Author, pk=pk)
+    response = await arender(request, 'blog/author_profile.html', {
+        'object': author,
+        'author': author,
+        'total_posts': author.published_posts,
+    })
+    return add_surrogate_keys(response, f'author:{pk}')
+
+
+@never_cache
+def visitor(request):
+    """
+    What the shared public pages leave out for the visitor: sign-in state,
+    the CSRF token of their forms and pending messages. Read by visitor.js.
+    """
+    user = request.user
+    data = {
+        'authenticated': user.is_authenticated,
+        'csrf_token': get_token(request),
+        'messages': [str(message) for message in messages.get_messages(request)],
+    }
+    if user.is_authenticated:
+        data.update(id=user.pk, username=user.username, email=user.email)
+    return JsonResponse(data)
 
 
-class UpdateProfile(LoginRequiredMixin, SuccessMessageMixin, generic.UpdateView):
+class UpdateProfile(LoginRequiredMixin, PrimaryDatabaseMixin, SuccessMessageMixin, generic.UpdateView):
     model = Author
     fields = ["first_name", "last_name", "email", "username", "description", "profile_photo"]
     template_name = "registration/update_profile.html"
@@ -170,8 +293,7 @@ class UpdateProfile(LoginRequiredMixin, SuccessMessageMixin, generic.UpdateView)
     success_message = "Профиль обновлен"
 
     def get_object(self, queryset=None):
-        user = self.request.user
-        return user
+        return Author.objects.get(pk=self.request.user.pk)
 
 
 class PasswordsChangeView(views.PasswordChangeView):
@@ -190,7 +312,7 @@ def contact(request, form, template_name):
             name = form.cleaned_data['name']
             email = form.cleaned_data['email']
             message = form.cleaned_data['message']
-            send_contact.delay(name, email, message)
+            Notification.objects.enqueue(name, message, [ADMIN_EMAIL], from_email=email)
             data['form_is_valid'] = True
             msg = [f"Сообщение от {name} отправлено"]
             data['msg_list'] = render_to_string('blog/message_contact.html', {
@@ -203,13 +325,44 @@ def contact(request, form, template_name):
     return JsonResponse(data)
 
 
-def contact_form(request):
+async def contact_form(request):
     if request.method == 'POST':
         form = ContactForm(request.POST)
     else:
         form = ContactForm()
-    return contact(request, form, 'blog/contact.html')
+    return await sync_to_async(contact)(request, form, 'blog/contact.html')
 
 
 def about_page(request):
     return render(request, 'blog/about.html')
+
+
+@staff_member_required
+def performance_stats(request):
+    return JsonResponse(registry.snapshot())
+
+
+@staff_member_required
+def db_pool_stats(request):
+    return JsonResponse(pool_stats())
+
+
+def _stored(name, content_type):
+    # Read whole: chunks are small once gzipped, and a streamed S3 body would
+    # be read on the event loop under ASGI.
+    if not default_storage.exists(name):
+        raise Http404('Карта сайта еще не создана')
+    with default_storage.open(name) as stored:
+        return HttpResponse(stored.read(), content_type=content_type)
+
+
+@require_safe
+@cache_control(public=True, max_age=60 * 60)
+def sitemap_index(request):
+    return _stored(SITEMAP_INDEX, 'application/xml; charset=utf-8')
+
+
+@require_safe
+@cache_control(public=True, max_age=60 * 60)
+def sitemap_file(request, name):
+    return _stored(f'{SITEMAP_DIR}/{name}', 'application/gzip')
@@ -1,3 +1,47 @@
+from kombu import Queue
+
 CELERY_TIMEZONE = "Europe/Kiev"
-CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+
+# Nothing reads task results or the STARTED state: don't write them to the backend.
+# regenerate_sitemaps.delay().get() still works eagerly (in tests).
+CELERY_TASK_IGNORE_RESULT = True
+
+# mail: e-mail readers and admins wait for; default: cache purges;
+# maintenance: bulk jobs that can wait (image variants, sitemaps).
+CELERY_TASK_QUEUES = (
+    Queue('mail', routing_key='mail'),
+    Queue('default', routing_key='default'),
+    Queue('maintenance', routing_key='maintenance'),
+)
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'blog.tasks.flush_notifications': {'queue': 'mail'},
+    'blog.tasks.new_comment': {'queue': 'mail'},
+    'blog.tasks.new_post': {'queue': 'mail'},
+    'blog.tasks.comment_active': {'queue': 'mail'},
+    'blog.tasks.send_contact': {'queue': 'mail'},
+    'blog.tasks.purge_surrogate_keys': {'queue': 'default'},
+    'blog.tasks.generate_image_variants': {'queue': 'maintenance'},
+    'blog.tasks.regenerate_sitemaps': {'queue': 'maintenance'},
+}
+# A worker consuming several queues empties them in the order given to -Q
+# (mail,default,maintenance) instead of round robin.
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+# Reserve one message per process at a time: a long image or sitemap job must
+# not keep prefetched mail waiting behind it.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+CELERY_BEAT_SCHEDULE = {
+    'flush-notifications': {
+        'task': 'blog.tasks.flush_notifications',
+        'schedule': 60.0,
+        # The next run sends whatever this one would have; don't let runs pile up while no worker is up.
+        'options': {'expires': 60.0},
+    },
+    'regenerate-sitemaps': {
+        'task': 'blog.tasks.regenerate_sitemaps',
+        'schedule': 60.0 * 60,
+        'options': {'expires': 60.0 * 60},
+    },
+}
@@ -46,8 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blog.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    'blog.middleware.StaticFilesMiddleware',
+    'blog.middleware.PrimaryPinningMiddleware',
+    'blog.middleware.EdgeCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,7 +63,7 @@ ROOT_URLCONF = 'hillels_django_blog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'blog.templating.DjangoTemplates',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -129,9 +132,14 @@ MESSAGE_TAGS = {
 }
 
 AUTHENTICATION_BACKENDS = (
-  'django.contrib.auth.backends.ModelBackend',
+  'blog.auth.SlimModelBackend',
 )
 
+# Sessions are read from the cache and only written through to the database
+# when they change (login, logout, messages). Visitors without a session
+# cookie never touch either.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [
@@ -139,3 +147,44 @@ STATICFILES_DIRS = [
 ]
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Full-page cache of public blog pages for anonymous visitors; entries are
+# also invalidated precisely through versioned keys, see blog/cache.py.
+BLOG_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Notification e-mails are queued and sent as per-recipient digests, either
+# by the periodic flush (CELERY_BEAT_SCHEDULE) or once this many are pending.
+BLOG_NOTIFICATION_BATCH_SIZE = 50
+
+# Per-request DB/template/cache timings from blog.middleware.PerformanceMiddleware,
+# aggregated per URL name at /blog/stats/performance/ (staff only).
+# BLOG_SERVER_TIMING also sends them to every visitor in a Server-Timing
+# header: development only.
+BLOG_SERVER_TIMING = False
+
+# URLs per sitemap chunk file (the protocol allows 50 000); see blog/sitemaps.py.
+# Changing it rebuilds every chunk on the next run.
+BLOG_SITEMAP_CHUNK_SIZE = 10000
+
+# Database aliases reads are spread over (see blog/routers.py); empty means
+# everything runs on 'default'. After a write the visitor reads from the
+# primary for this long, to cover replication lag.
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+BLOG_READ_REPLICAS = []
+BLOG_PRIMARY_PIN_SECONDS = 10
+
+# Reverse proxy / CDN in front of the app (see blog/edge.py): public pages
+# name what they show in this header and are kept at the edge this long;
+# saves purge their keys through BLOG_PURGE_BACKEND.
+BLOG_SURROGATE_KEY_HEADER = 'Surrogate-Key'
+BLOG_EDGE_CACHE_SECONDS = 60 * 60 * 24
+BLOG_PURGE_BACKEND = 'blog.edge.NullPurgeBackend'
+BLOG_PURGE_OPTIONS = {}
+
+# Celery tasks queued by saves are written to the outbox table in the same
+# transaction and published by `manage.py relay_outbox` in batches of this
+# size (see OutboxManager in blog/models.py). With BLOG_OUTBOX_RELAY_ON_COMMIT
+# the request publishes its own tasks right after the commit instead, so no
+# relay process is needed, at the cost of waiting for the broker.
+BLOG_OUTBOX_BATCH_SIZE = 500
+BLOG_OUTBOX_RELAY_ON_COMMIT = False
@@ -19,6 +19,8 @@ DATABASES = {
 
 DEBUG = True
 
+BLOG_SERVER_TIMING = True
+
 ALLOWED_HOSTS = []
 
 # Installed apps for development only:
@@ -50,6 +52,8 @@ CACHES = {
 
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
+# No relay_outbox process locally: publish tasks right after the commit.
+BLOG_OUTBOX_RELAY_ON_COMMIT = True
 
 MEDIA_ROOT = os.path.join('media')
 MEDIA_URL = '/media/'
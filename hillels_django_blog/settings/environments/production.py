@@ -5,14 +5,52 @@ import dj_database_url
 
 DATABASES = {}
 
-db_from_env = dj_database_url.config(conn_max_age=600)
-DATABASES['default'] = db_from_env
+
+def database(config):
+    """
+    Connections come from blog.pool: at most BLOG_DB_POOL_SIZE per database
+    and worker process, health-checked before reuse and handed back at the
+    end of every request (CONN_MAX_AGE=0). With DATABASE_POOLER=pgbouncer
+    the URLs point at PgBouncer in transaction mode, which does the pooling.
+    """
+    if os.environ.get('DATABASE_POOLER') == 'pgbouncer':
+        # Server-side cursors (QuerySet.iterator()) do not survive transaction pooling.
+        config['DISABLE_SERVER_SIDE_CURSORS'] = True
+    else:
+        config['ENGINE'] = 'blog.backends.postgresql'
+        config['POOL'] = {'SIZE': int(os.environ.get('BLOG_DB_POOL_SIZE', 10)), 'TIMEOUT': 10}
+    return config
+
+
+db_from_env = dj_database_url.config(conn_max_age=0)
+DATABASES['default'] = database(db_from_env)
+
+# Read replicas (e.g. Heroku Postgres followers): space-separated database URLs.
+BLOG_READ_REPLICAS = []
+for number, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), start=1):
+    DATABASES[f'replica{number}'] = database(dj_database_url.parse(url, conn_max_age=0))
+    BLOG_READ_REPLICAS.append(f'replica{number}')
 
 DEBUG = False
 
 ALLOWED_HOSTS = ['0.0.0.0', 'localhost', '127.0.0.1', 'hillels-django-blog.herokuapp.com']
 
-STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
+# Minified, content-hashed files with gzip and Brotli copies; WhiteNoise
+# serves the hashed names with a far-future immutable Cache-Control.
+STATICFILES_STORAGE = "blog.storage.OptimizedManifestStaticFilesStorage"
+
+# Shared by all workers: page cache, cache versions and sessions.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    }
+}
+
+# Fastly in front of the dyno, when configured.
+if os.environ.get('FASTLY_SERVICE_ID'):
+    BLOG_PURGE_BACKEND = 'blog.edge.FastlyPurgeBackend'
+    BLOG_PURGE_OPTIONS = {'service_id': os.environ['FASTLY_SERVICE_ID'], 'api_token': os.environ['FASTLY_API_TOKEN']}
 
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL')
 CELERY_BROKER_URL = os.environ.get('REDIS_URL')
@@ -0,0 +1,57 @@
+import os
+
+from hillels_django_blog.settings.components.common import BASE_DIR
+
+# Run with: DJANGO_ENV=test ./manage.py test
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'test-secret-key')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test.sqlite3'),
+    },
+    # A separate, not mirrored database: replica routing tests can tell where a read went.
+    # Only used with override_settings(BLOG_READ_REPLICAS=['replica']).
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'test_replica.sqlite3'),
+    },
+}
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['testserver', 'localhost', '127.0.0.1']
+
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+# Email
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+
+# CASHES and CELERY
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+
+BLOG_PURGE_BACKEND = 'blog.edge.RecordingPurgeBackend'
+# Run queued tasks (eagerly) at commit, as before the outbox; OutboxTests relay explicitly.
+BLOG_OUTBOX_RELAY_ON_COMMIT = True
+
+MEDIA_ROOT = os.path.join('media')
+MEDIA_URL = '/media/'
+
+# URL
+
+SCHEMA = 'http'
+
+DOMAIN = "testserver"
@@ -13,19 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from blog.views import PasswordsChangeView, SignUpView, UpdateProfile, UserProfile, password_success
+from blog.views import PasswordsChangeView, SignUpView, UpdateProfile, UserProfile, password_success, sitemap_file, \
+    sitemap_index
 
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth.views import PasswordResetCompleteView, PasswordResetConfirmView, PasswordResetDoneView,\
     PasswordResetView
-from django.urls import include, path
+from django.urls import include, path, re_path
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('blog/', include('blog.urls', namespace='blog')),
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    re_path(r'^sitemaps/(?P<name>[\w-]+\.xml\.gz)$', sitemap_file, name='sitemap_file'),
     path(
         'accounts/password_change/',
         PasswordsChangeView.as_view(template_name='registration/change-password.html'),